@@ -17,11 +17,52 @@ token = settings.TOKEN
 channelID = settings.CHID
 ntn_layout = settings.NTN_LO
 bfs_themes = settings.BFS_TH
+aap_letters = settings.AAP_LT
+dm_cache_path = settings.DM_CACHE_PATH
+dm_cache_size = settings.DM_CACHE_SIZE
+max_content_length = settings.MAX_CONTENT_LENGTH
+tab_archive_dir = settings.TAB_ARCHIVE_DIR
+content_cache_dir = settings.CONTENT_CACHE_DIR
+content_watch_interval = settings.CONTENT_WATCH_INTERVAL
+journal_dir = settings.JOURNAL_DIR
+snapshot_interval = settings.SNAPSHOT_INTERVAL
+turn_deadline = settings.TURN_DEADLINE
+turn_nudge = settings.TURN_NUDGE
+auto_advance = settings.AUTO_ADVANCE
+session_idle = settings.SESSION_IDLE
+session_ttl = settings.SESSION_TTL
+session_memory_budget = settings.SESSION_MEMORY_BUDGET
 
 if token == "" or channelID == "":
     raise ValueError(".env not set properly")
 
 gamebox.load_channel(int(channelID))
+gamebox.set_content_cache(content_cache_dir)
+if content_watch_interval is not None:
+    gamebox.set_content_watch_interval(float(content_watch_interval))
 gamebox.set_ntn_lo(ntn_layout)
 gamebox.set_bfs_th(bfs_themes)
+gamebox.set_aap_lt(aap_letters)
+gamebox.set_tab_archive(tab_archive_dir)
+if dm_cache_size is None:
+    gamebox.set_dm_cache(dm_cache_path)
+else:
+    gamebox.set_dm_cache(dm_cache_path, int(dm_cache_size))
+if snapshot_interval is None:
+    gamebox.set_journal(journal_dir)
+else:
+    gamebox.set_journal(journal_dir, float(snapshot_interval))
+if turn_deadline is not None:
+    gamebox.set_turn_deadline(
+        float(turn_deadline),
+        0.0 if turn_nudge is None else float(turn_nudge),
+        auto_advance in ("1", "true", "True"),
+    )
+gamebox.set_eviction(
+    0.0 if session_idle is None else float(session_idle),
+    0.0 if session_ttl is None else float(session_ttl),
+    0 if session_memory_budget is None else int(session_memory_budget),
+)
+if max_content_length is not None:
+    gamebox.set_max_content_length(int(max_content_length))
 gamebox.run(token)
@@ -12,3 +12,18 @@ TOKEN = os.environ.get("DISCO_TOKEN")
 CHID = os.environ.get("DISCO_CHID")
 NTN_LO = os.environ.get("NTN_LO")
 BFS_TH = os.environ.get("BFS_TH")
+AAP_LT = os.environ.get("AAP_LT")
+DM_CACHE_PATH = os.environ.get("DM_CACHE_PATH")
+DM_CACHE_SIZE = os.environ.get("DM_CACHE_SIZE")
+MAX_CONTENT_LENGTH = os.environ.get("MAX_CONTENT_LENGTH")
+TAB_ARCHIVE_DIR = os.environ.get("TAB_ARCHIVE_DIR")
+CONTENT_CACHE_DIR = os.environ.get("CONTENT_CACHE_DIR")
+CONTENT_WATCH_INTERVAL = os.environ.get("CONTENT_WATCH_INTERVAL")
+JOURNAL_DIR = os.environ.get("JOURNAL_DIR")
+SNAPSHOT_INTERVAL = os.environ.get("SNAPSHOT_INTERVAL")
+TURN_DEADLINE = os.environ.get("TURN_DEADLINE")
+TURN_NUDGE = os.environ.get("TURN_NUDGE")
+AUTO_ADVANCE = os.environ.get("AUTO_ADVANCE")
+SESSION_IDLE = os.environ.get("SESSION_IDLE")
+SESSION_TTL = os.environ.get("SESSION_TTL")
+SESSION_MEMORY_BUDGET = os.environ.get("SESSION_MEMORY_BUDGET")
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Discordに接続せずに各ゲームのコントローラを最後まで進行させ、処理性能を計測する。
+
+例:
+    python simulate.py --game all --players 8 --cycles 2 --tables 16
+    python simulate.py --flood --tables 32 --send-latency 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+import discord
+
+from source.game_box import GameBox
+from source.game_controller import GameController, OnMessageResponse
+from source.member_directory import MemberDirectory
+from source.session import Session
+from source.tab.tab_controller import TABController
+from source.aap.aap_controller import AAPController
+from source.ntn.ntn_controller import NTNController
+from source.ntn.script import get_layout_list
+from source.bfs.bfs_controller import BFSController
+
+SIM_CHANNEL_ID = 0
+
+class FakeGuild:
+    __slots__ = ("id",)
+
+    def __init__(self, id: int) -> None:
+        self.id = id
+
+class FakeChannel:
+    __slots__ = ("id",)
+
+    def __init__(self, id: int) -> None:
+        self.id = id
+
+class FakeMember:
+    """
+    discord.Member のうち、コントローラが参照する属性だけを持つ代替品。
+    """
+    __slots__ = ("id", "name", "bot", "guild")
+
+    def __init__(self, id: int, name: str, guild: FakeGuild) -> None:
+        self.id = id
+        self.name = name
+        self.bot = False
+        self.guild = guild
+
+class FakeMessage:
+    """
+    discord.Message のうち、コントローラが参照する属性だけを持つ代替品。
+    """
+    __slots__ = ("content", "author", "guild", "channel")
+
+    def __init__(self, content: str, author: FakeMember, channel: FakeChannel) -> None:
+        self.content = content
+        self.author = author
+        self.guild = author.guild
+        self.channel = channel
+
+Step = Tuple[str, FakeMember]
+# 手順の区切り。--flood では、ここまでのコマンドの処理が終わってから続きの手順を作る
+BARRIER: Step = ("", None)
+
+def tab_game(gc: TABController, players: List[FakeMember], args) -> Iterator[Step]:
+    gm = players[0]
+    yield f"!set_cycles {args.cycles}", gm
+    yield "!start_game", gm
+    for i, p in enumerate(players):
+        yield f"!set_title 本{i}", p
+    yield "!start_script", gm
+    for page in range(args.cycles * len(players)):
+        for p in players:
+            yield f"!set_script {'あ' * args.text_length}\n{page}", p
+        yield "!next_turn", gm
+
+def aap_game(gc: AAPController, players: List[FakeMember], args) -> Iterator[Step]:
+    gm = players[0]
+    yield f"!set_pattern {args.pattern}", gm
+    yield "!start_game", gm
+    for i in range(sum(int(x) for x in args.pattern.split(","))):
+        for p in players:
+            yield f"!set_letter {'あいうえお'[i % 5]}", p
+
+def ntn_game(gc: NTNController, players: List[FakeMember], args) -> Iterator[Step]:
+    gm = players[0]
+    yield "!start_game", gm
+    yield BARRIER
+    if gc.phase == "standby":
+        raise RuntimeError("NTN game did not start (too many players for the layout?)")
+    for p in players:
+        for blank_id in gc.playermaster.get_player(p.name).get_valid_ids():
+            yield f"!fill {blank_id + 1} {'い' * args.text_length}", p
+    yield "!end_fill", gm
+    for _ in range(gc.script.num_blank):
+        yield "!open", gm
+
+def bfs_game(gc: BFSController, players: List[FakeMember], args) -> Iterator[Step]:
+    gm = players[0]
+    yield f"!set_cycles {args.cycles}", gm
+    yield "!start_game", gm
+    for _ in range(args.cycles * len(players)):
+        for p in players:
+            yield f"!submit {'う' * args.text_length}", p
+        yield "!end_submit", gm
+        yield "!next", gm
+
+GAMES: Dict[str, Tuple[Callable[[], GameController], Callable]] = {
+    "tab": (TABController, tab_game),
+    "aap": (AAPController, aap_game),
+    "ntn": (lambda: NTNController(None), ntn_game),
+    "bfs": (lambda: BFSController(None), bfs_game),
+}
+
+def get_num_players(name: str, args) -> int:
+    """
+    1卓のプレイヤー数。NTN はどのレイアウトが選ばれても始められるよう、空欄の最も少ないレイアウトに合わせる。
+    """
+    if name == "ntn":
+        return min(args.players, min(lo.num_blank for lo in get_layout_list(None)))
+    return args.players
+
+# !launch_game に渡す番号
+SWITCH_IDS = {
+    "tab": 1,
+    "aap": 2,
+    "ntn": 3,
+    "bfs": 4,
+}
+
+class FloodBox(GameBox):
+    """
+    GameBox のうち、送信を一定時間待つだけの処理に置き換えたもの。
+    送信中のコマンドの数をセッションごとに数え、同じセッションで重なっていないかを調べる。
+    """
+    send_latency: float
+    in_flight: Counter # of session key: number of commands being sent
+    max_in_flight_per_session: int
+    max_in_flight: int
+    num_sent: int
+
+    def __init__(self, send_latency: float) -> None:
+        super().__init__(intents=discord.Intents.none())
+        self.send_latency = send_latency
+        self.in_flight = Counter()
+        self.max_in_flight_per_session = 0
+        self.max_in_flight = 0
+        self.num_sent = 0
+
+    @property
+    def user(self) -> FakeMember:
+        return SIM_BOT
+
+    async def send_messages(self, session: Session, on_message_res: OnMessageResponse) -> None:
+        self.in_flight[session.key] += 1
+        self.max_in_flight_per_session = max(self.max_in_flight_per_session, self.in_flight[session.key])
+        self.max_in_flight = max(self.max_in_flight, sum(self.in_flight.values()))
+        try:
+            await super().send_messages(session, on_message_res)
+        finally:
+            self.in_flight[session.key] -= 1
+
+    async def send_message(
+            self,
+            session: Session,
+            name: Union[str, None],
+            message: Union[str, discord.File],
+        ) -> Union[discord.Message, None]:
+        await asyncio.sleep(self.send_latency)
+        self.num_sent += 1
+        return None
+
+SIM_BOT = FakeMember(-1, "simulator", FakeGuild(-1))
+
+class SessionGC:
+    """
+    卓のセッションで現在動いているコントローラの属性を読む代替品。
+    !launch_game でコントローラが作り直されても、手順を作る側からは同じものとして扱える。
+    """
+    _box: GameBox
+    _key: int
+
+    def __init__(self, box: GameBox, key: int) -> None:
+        self._box = box
+        self._key = key
+
+    def __getattr__(self, name: str):
+        return getattr(self._box.sessions.get(self._key).gc, name)
+
+async def flood_table(box: GameBox, channel: FakeChannel, steps: Iterator[Step]) -> int:
+    """
+    BARRIER までの手順をまとめて GameBox.on_message に投げ込み、処理したコマンドの数を返す。
+    """
+    num_commands = 0
+    pending = []
+    for step in steps:
+        if step is BARRIER:
+            await asyncio.gather(*pending)
+            pending = []
+            continue
+        content, author = step
+        pending.append(asyncio.ensure_future(box.on_message(FakeMessage(content, author, channel))))
+        num_commands += 1
+    await asyncio.gather(*pending)
+    return num_commands
+
+async def run_flood(name: str, args) -> Dict[str, float]:
+    """
+    args.tables 卓の全コマンドを一度に GameBox.on_message に投げ込み、
+    各卓が最後まで進んだかを確かめたうえで、送信中のコマンドの最大数を返す。
+    """
+    _, game = GAMES[name]
+    num_players = get_num_players(name, args)
+    box = FloodBox(args.send_latency / 1000)
+    box.load_channel(SIM_CHANNEL_ID)
+    box.set_content_watch_interval(0)
+    await box.setup_hook()
+
+    guild = FakeGuild(0)
+    tables = []
+    for t in range(args.tables):
+        channel = FakeChannel(SIM_CHANNEL_ID + t)
+        players = [
+            FakeMember(t * num_players + i, f"t{t}p{i}", guild)
+            for i in range(num_players)
+        ]
+        for p in players:
+            box.members.add(p)
+        steps = itertools.chain(
+            [(f"!launch_game {SWITCH_IDS[name]}", players[0])],
+            [("!join", p) for p in players],
+            [BARRIER],
+            game(SessionGC(box, channel.id), players, args),
+        )
+        tables.append((channel, steps))
+
+    start = time.perf_counter()
+    num_commands = await asyncio.gather(*[
+        flood_table(box, channel, steps) for channel, steps in tables
+    ])
+    elapsed = time.perf_counter() - start
+
+    for t in range(args.tables):
+        phase = box.sessions.get(SIM_CHANNEL_ID + t).gc.phase
+        if phase != "standby":
+            raise RuntimeError(f"{name} table {t} did not finish (phase {phase})")
+    return {
+        "commands": sum(num_commands),
+        "throughput": sum(num_commands) / elapsed,
+        "sent": box.num_sent,
+        "max_in_flight": box.max_in_flight,
+        "max_in_flight_per_session": box.max_in_flight_per_session,
+    }
+
+def flood(name: str, args) -> Dict[str, float]:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(run_flood(name, args))
+
+def run_tables(name: str, args) -> List[int]:
+    """
+    args.tables 卓を1コマンドずつ交互に進め、各コマンドの処理時間（ns）のリストを返す。
+    """
+    create, game = GAMES[name]
+    num_players = get_num_players(name, args)
+    guild = FakeGuild(0)
+    members = MemberDirectory(lambda: [])
+    tables = []
+    for t in range(args.tables):
+        players = [
+            FakeMember(t * num_players + i, f"t{t}p{i}", guild)
+            for i in range(num_players)
+        ]
+        for p in players:
+            members.add(p)
+        gc = create()
+        gc.initialize(members, SIM_CHANNEL_ID + t)
+        tables.append((gc, FakeChannel(SIM_CHANNEL_ID + t), players))
+
+    latencies: List[int] = []
+    for game_i in range(args.games):
+        active = []
+        for gc, channel, players in tables:
+            steps = game(gc, players, args)
+            if game_i == 0:
+                steps = itertools.chain([("!join", p) for p in players], steps)
+            active.append((gc, channel, steps))
+        while active:
+            still_active = []
+            for gc, channel, steps in active:
+                step = next(steps, None)
+                if step is None:
+                    continue
+                if step is BARRIER:
+                    still_active.append((gc, channel, steps))
+                    continue
+                message = FakeMessage(step[0], step[1], channel)
+                start = time.perf_counter_ns()
+                gc.on_message(message)
+                latencies.append(time.perf_counter_ns() - start)
+                still_active.append((gc, channel, steps))
+            active = still_active
+        for gc, _, _ in tables:
+            if gc.phase != "standby":
+                raise RuntimeError(f"{name} table did not finish (phase {gc.phase})")
+    return latencies
+
+def percentile(sorted_values: List[int], q: float) -> int:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+def simulate(name: str, args) -> Dict[str, float]:
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        latencies = run_tables(name, args)
+        elapsed = time.perf_counter() - start
+
+        peak = 0
+        if args.memory:
+            tracemalloc.start()
+            run_tables(name, args)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "commands": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50_us": percentile(latencies, 0.50) / 1000,
+        "p99_us": percentile(latencies, 0.99) / 1000,
+        "peak_kib": peak / 1024,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate games without a Discord connection.")
+    parser.add_argument("--game", choices=list(GAMES.keys()) + ["all"], default="all")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--cycles", type=int, default=1, help="TAB/BFS cycles")
+    parser.add_argument("--pattern", default="5,7,5", help="AAP pattern")
+    parser.add_argument("--text-length", type=int, default=200, help="length of submitted texts")
+    parser.add_argument("--tables", type=int, default=1, help="number of concurrent tables")
+    parser.add_argument("--games", type=int, default=1, help="games played per table")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc pass")
+    parser.add_argument("--flood", action="store_true",
+                        help="send every command of every table at once through GameBox.on_message")
+    parser.add_argument("--send-latency", type=float, default=5.0, help="simulated send latency in ms (flood)")
+    args = parser.parse_args()
+
+    names = list(GAMES.keys()) if args.game == "all" else [args.game]
+    for name in names:
+        num_players = get_num_players(name, args)
+        if num_players < args.players:
+            print(f"{name}: the layouts have too few blanks for {args.players} players, using {num_players}")
+    if args.flood:
+        print(f"{'game':>4} {'commands':>9} {'cmd/s':>10} {'sent':>8} {'parallel':>9}")
+        for name in names:
+            r = flood(name, args)
+            if r["max_in_flight_per_session"] > 1:
+                raise RuntimeError(f"{name} commands of one table overlapped")
+            print(f"{name:>4} {r['commands']:>9d} {r['throughput']:>10.0f} "
+                  f"{r['sent']:>8d} {r['max_in_flight']:>9d}")
+        return
+
+    print(f"{'game':>4} {'commands':>9} {'cmd/s':>10} {'p50[us]':>9} {'p99[us]':>9} {'peak[KiB]':>10}")
+    for name in names:
+        r = simulate(name, args)
+        print(f"{name:>4} {r['commands']:>9d} {r['throughput']:>10.0f} "
+              f"{r['p50_us']:>9.1f} {r['p99_us']:>9.1f} {r['peak_kib']:>10.0f}")
+
+if __name__ == "__main__":
+    main()
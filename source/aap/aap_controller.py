@@ -1,26 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from types import MappingProxyType
+from typing import Hashable, List, Mapping, Tuple, Union
+
 import discord
-import mojimoji
 
 from source.command import Command
-from source.game_controller import GameController, OnMessageResponse, COMMANDS_B, ALWAYS_ALLOWED_COMMANDS_B
+from source.game_controller import GameController, OnMessageResponse, COMMANDS_B, ALWAYS_ALLOWED_COMMANDS_B, HANDLERS_B
+from source.member_directory import MemberDirectory
+from source.router import CommandRouter
+from source.aap.letters import DEFAULT_LETTER_TABLE
 from source.aap.player import PlayerMaster, UnknownPlayerError
 
 DEFAULT_PATTERN = [5, 7, 5]
 MAX_LET_PER_COL = 10
-ALLOWED_LETTERS = "0123456789" \
-                + "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz" \
-                + "０１２３４５６７８９" \
-                + "ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺ" \
-                + "ａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚ" \
-                + "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほ" \
-                + "まみむめもやゆよらりるれろわをんがぎぐげござじずぜぞだぢづでど" \
-                + "ばびぶべぼぱぴぷぺぽぁぃぅぇぉっゃゅょゎゐゑ" \
-                + "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホ" \
-                + "マミムメモヤユヨラリルレロワヲンガギグゲゴザジズゼゾダヂヅデド" \
-                + "バビブベボパピプペポァィゥェォヵッャュョヮーヰヱ"
+DEFAULT_LETTER = "　"
 ICONS_A = {
     "MAIN": ":book:",
     "CAUT": ":exclamation:",
@@ -59,50 +54,52 @@ ALWAYS_ALLOWED_COMMANDS_A = [
     "SHOWPL",
 ]
 ALWAYS_ALLOWED_COMMANDS_A += ALWAYS_ALLOWED_COMMANDS_B
+HANDLERS_A = {
+    **HANDLERS_B,
+    "SHOWPL": "show_players",
+    "JOIN": "join",
+    "LEAVE": "leave",
+    "RESETMMB": "reset_players",
+    "SETPAT": "set_pattern",
+    "START": "start_game",
+    "QUITGM": "quit_game",
+    "SETLET": "set_letter",
+}
 
 class AAPController(GameController):
-    allowed_commands_per_phase: dict # of str: str
-    commands_dictionary: dict # of str: Command
-    function_dictionary: dict # of str: function
+    commands_dictionary: Mapping[str, Command] = MappingProxyType({**COMMANDS_A, **COMMANDS_B})
+    router: CommandRouter = CommandRouter(
+        commands_dictionary, HANDLERS_A,
+        ALLOWED_COMMANDS_PER_PHASE_A, ALWAYS_ALLOWED_COMMANDS_A,
+    )
     gamech_id: int
     phase: str
     pattern: list # of int
-    members: list # of discord.Member
+    members: MemberDirectory
     playermaster: PlayerMaster
     poetry_index: int
+    letter_table: Mapping[str, str]
+
+    def __init__(self, letter_table: Mapping[str, str] = DEFAULT_LETTER_TABLE) -> None:
+        super().__init__()
+        self.letter_table = letter_table
+
+    def __getstate__(self) -> dict:
+        state = super().__getstate__()
+        state["letter_table"] = dict(self.letter_table)
+        return state
 
-    def initialize(self, get_all_members, gamech_id: int):
-        self.get_all_members = get_all_members
+    def __setstate__(self, state: dict) -> None:
+        state["letter_table"] = MappingProxyType(state["letter_table"])
+        self.__dict__.update(state)
+
+    def initialize(self, members: MemberDirectory, gamech_id: int):
         self.gamech_id = gamech_id
         self.pattern = DEFAULT_PATTERN
-        self.members = [member for member in self.get_all_members()]
+        self.members = members
         self.playermaster = PlayerMaster(self.pattern, MAX_LET_PER_COL)
         self.poetry_index = 0
 
-        self.commands_dictionary = COMMANDS_A
-        self.commands_dictionary.update(COMMANDS_B)
-
-        self.allowed_commands_per_phase = {}
-        for p in PHASES.values():
-            self.allowed_commands_per_phase[p] = []
-            for c in ALLOWED_COMMANDS_PER_PHASE_A[p] + ALWAYS_ALLOWED_COMMANDS_A:
-                self.allowed_commands_per_phase[p]\
-                                .append(self.commands_dictionary[c].get_command())
-
-        self.function_dictionary = {
-            self.commands_dictionary["HLP"].get_command(): self.help,
-            self.commands_dictionary["SHOWPL"].get_command(): self.show_players,
-            self.commands_dictionary["JOIN"].get_command(): self.join,
-            self.commands_dictionary["LEAVE"].get_command(): self.leave,
-            self.commands_dictionary["RESETMMB"].get_command(): self.reset_players,
-            self.commands_dictionary["SETPAT"].get_command(): self.set_pattern,
-            self.commands_dictionary["SETCH"].get_command(): self.set_channel,
-            self.commands_dictionary["RELOADMMB"].get_command(): self.reload_member,
-            self.commands_dictionary["START"].get_command(): self.start_game,
-            self.commands_dictionary["QUITGM"].get_command(): self.quit_game,
-            self.commands_dictionary["SETLET"].get_command(): self.set_letter,
-        }
-
         self.phase = PHASES["S"]
         self.cycles = 1
 
@@ -194,52 +191,75 @@ class AAPController(GameController):
         if len(content) > 1:
             ret_mes = f"{ICONS_A['CAUT']} 送信できるのは1文字までです！"
             return OnMessageResponse([(author.name, ret_mes)])
-        elif not content in ALLOWED_LETTERS:
+        letter = self.letter_table.get(content)
+        if letter is None:
             ret_mes = f"{ICONS_A['CAUT']} 無効な文字です！"
             return OnMessageResponse([(author.name, ret_mes)])
-        letter = mojimoji.han_to_zen(content)
-        if letter == "ー":
-            letter = "｜"
         ret_mes = f"{ICONS_A['MAIN']} {self.poetry_index + 1}文字目の変更を受け付けました！"
         all_set = False
         try:
             all_set = self.playermaster.set_poetry_letter\
                                     (author.name, letter, self.poetry_index)
+            ret_mes += f"（{self.playermaster.count_letters_set()}/" \
+                     + f"{self.playermaster.len_players()}人が設定済み）"
         except UnknownPlayerError:
             ret_mes = f"{ICONS_A['CAUT']} ゲームに参加していません！"
         ret.append((author.name, ret_mes))
 
         if all_set:
             # 全員がi文字目を設定した段階で次のターンに移る
-            if self.poetry_index == sum(self.pattern) - 1:
-                # 最終文字が終了した場合
-
-                # 全員へ完成した本文を送付する
-                players = self.playermaster.get_players()
-                for p in players:
-                    ret_mes = f"{ICONS_A['MAIN']} あなたの送り出した詩が完成しました！\n" \
-                            + "```\n" \
-                            + f"{p.get_displayable_poetry()}\n" \
-                            + "```"
-                    ret.append((p.get_name(), ret_mes))
-
-                # 共有情報
-                ret_mes = f"{ICONS_A['MAIN']} 全員の詩が完成しました！参加者全員の個人チャットに完成した詩を送付しました。"
-                self.phase = PHASES["S"]
-                ret.append((None, ret_mes))
-            else:
-                # 共有情報
-                self.poetry_index += 1
-                ret_mes = f"{self.poetry_index + 1}文字目を執筆中……"
-                self.playermaster.next_letter()
-                ret.append((None, ret_mes))
-
-                # 全員へ本文執筆の通知
-                for p in self.playermaster.get_players():
-                    ret_mes = f"{ICONS_A['MAIN']} あなたの前のターンの詩の内容は以下の通りでした。\n" \
-                            + "```\n" \
-                            + f"{self.playermaster.get_target_poetry(p.get_name())}\n" \
-                            + "```"
-                    ret.append((p.get_name(), ret_mes))
+            ret += self.finish_letter()
         
         return OnMessageResponse(ret)
+
+    def finish_letter(self) -> List[Tuple[Union[str, None], str]]:
+        ret: List[Tuple[Union[str, None], str]] = []
+        if self.poetry_index == sum(self.pattern) - 1:
+            # 最終文字が終了した場合
+
+            # 全員へ完成した本文を送付する
+            players = self.playermaster.get_players()
+            for p in players:
+                ret_mes = f"{ICONS_A['MAIN']} あなたの送り出した詩が完成しました！\n" \
+                        + "```\n" \
+                        + f"{p.get_displayable_poetry()}\n" \
+                        + "```"
+                ret.append((p.get_name(), ret_mes))
+
+            # 共有情報
+            ret_mes = f"{ICONS_A['MAIN']} 全員の詩が完成しました！参加者全員の個人チャットに完成した詩を送付しました。"
+            self.phase = PHASES["S"]
+            ret.append((None, ret_mes))
+        else:
+            # 共有情報
+            self.poetry_index += 1
+            ret_mes = f"{self.poetry_index + 1}文字目を執筆中……"
+            self.playermaster.next_letter()
+            ret.append((None, ret_mes))
+
+            # 全員へ本文執筆の通知
+            for p in self.playermaster.get_players():
+                ret_mes = f"{ICONS_A['MAIN']} あなたの前のターンの詩の内容は以下の通りでした。\n" \
+                        + "```\n" \
+                        + f"{self.playermaster.get_target_poetry(p.get_name())}\n" \
+                        + "```"
+                ret.append((p.get_name(), ret_mes))
+        return ret
+
+    def get_turn_key(self) -> Union[Hashable, None]:
+        if self.phase == PHASES["G"]:
+            return (self.phase, self.poetry_index)
+        return None
+
+    def pending_players(self) -> List[str]:
+        if self.phase == PHASES["G"]:
+            return self.playermaster.get_pending_players()
+        return []
+
+    def on_deadline(self) -> OnMessageResponse:
+        if self.phase != PHASES["G"]:
+            return OnMessageResponse([])
+        for name in self.pending_players():
+            self.playermaster.set_poetry_letter(name, DEFAULT_LETTER, self.poetry_index)
+        ret_mes = f"{ICONS_A['CAUT']} 締め切りを過ぎたため、未入力の{self.poetry_index + 1}文字目を空白として進めます。"
+        return OnMessageResponse([(None, ret_mes)] + self.finish_letter())
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+from types import MappingProxyType
+from typing import Dict, Mapping, Union
+
+import mojimoji
+
+DEFAULT_ALLOWED_LETTERS = "0123456789" \
+                        + "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz" \
+                        + "０１２３４５６７８９" \
+                        + "ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺ" \
+                        + "ａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚ" \
+                        + "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほ" \
+                        + "まみむめもやゆよらりるれろわをんがぎぐげござじずぜぞだぢづでど" \
+                        + "ばびぶべぼぱぴぷぺぽぁぃぅぇぉっゃゅょゎゐゑ" \
+                        + "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホ" \
+                        + "マミムメモヤユヨラリルレロワヲンガギグゲゴザジズゼゾダヂヅデド" \
+                        + "バビブベボパピプペポァィゥェォヵッャュョヮーヰヱ"
+# 縦書きで表示するときに置き換える文字
+DEFAULT_GLYPH_SUBSTITUTIONS = {
+    "ー": "｜",
+}
+
+class InvalidLettersError(Exception):
+    pass
+
+def build_letter_table(allowed: str, substitutions: Dict[str, str]) -> Mapping[str, str]:
+    """
+    入力可能な文字から、表示に使う文字への対応表を作る。
+    半角英数字は全角に変換し、そのあと substitutions による置き換えを行う。
+    """
+    table = {}
+    for c in allowed:
+        letter = mojimoji.han_to_zen(c)
+        table[c] = substitutions.get(letter, letter)
+    return MappingProxyType(table)
+
+def load_letter_table(lt_path: Union[str, None]) -> Mapping[str, str]:
+    """
+    lt_path: "extra_letters"（追加で許可する文字列）と
+             "substitutions"（置き換える文字の対応）を持つJSONファイルのパス
+    """
+    if lt_path is None:
+        return DEFAULT_LETTER_TABLE
+
+    with open(lt_path, "r") as f:
+        try:
+            lt_dict: dict = json.loads(f.read())
+        except ValueError:
+            raise InvalidLettersError()
+    extra_letters = lt_dict.get("extra_letters", "")
+    substitutions = lt_dict.get("substitutions", {})
+    if not isinstance(extra_letters, str) or not isinstance(substitutions, dict):
+        raise InvalidLettersError()
+    return build_letter_table(
+        DEFAULT_ALLOWED_LETTERS + extra_letters,
+        {**DEFAULT_GLYPH_SUBSTITUTIONS, **substitutions},
+    )
+
+DEFAULT_LETTER_TABLE = build_letter_table(DEFAULT_ALLOWED_LETTERS, DEFAULT_GLYPH_SUBSTITUTIONS)
@@ -43,8 +43,10 @@ class PlayerMaster:
     _name_index_map: dict # of str: int
     _pattern: list # of int
     _max_letters_per_column: int
+    _num_letters_set: int
 
     def __init__(self, pattern: list, max_letters_per_column: int):
+        self._num_letters_set = 0
         self._players = []
         self._rand_indexes = []
         self._name_index_map = {}
@@ -102,6 +104,7 @@ class PlayerMaster:
             p_name = self._players[i].get_name()
             self._name_index_map[p_name] = i
             self._players[i].add_poetry_letter()
+        self._num_letters_set = 0
     
     def get_target_poetry(self, player_name: str) -> str:
         target_poetry_index = self._name_index_map.get(player_name)
@@ -114,7 +117,12 @@ class PlayerMaster:
         target_poetry_index = self._name_index_map.get(player_name)
         if target_poetry_index is None:
             raise UnknownPlayerError()
-        self._players[target_poetry_index].set_poetry_letter(letter, index)
+        target = self._players[target_poetry_index]
+        letters = target.get_poetry().get_letters()
+        counts = index == len(letters) - 1 and letters[index] is None
+        target.set_poetry_letter(letter, index)
+        if counts:
+            self._num_letters_set += 1
         return self.latest_letters_are_set()
     
     def next_letter(self) -> None:
@@ -124,9 +132,19 @@ class PlayerMaster:
                                 self._name_index_map[p_name])
             self._name_index_map[p_name] = self._rand_indexes[next_i]
             self._players[i].add_poetry_letter()
+        self._num_letters_set = 0
+
+    def get_pending_players(self) -> list:
+        return [
+            p.get_name() for p in self._players
+            if not self._players[self._name_index_map[p.get_name()]].latest_letter_is_set()
+        ]
 
     def latest_letters_are_set(self) -> bool:
-        return all(p.latest_letter_is_set() for p in self._players)
+        return self._num_letters_set == len(self._players)
+
+    def count_letters_set(self) -> int:
+        return self._num_letters_set
 
 def find_next(l: list, v: any) -> int:
     key_i = -1
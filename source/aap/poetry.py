@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+from typing import Union
 
 class InvalidPageError(Exception):
     pass
@@ -11,62 +12,77 @@ class Poetry:
     _letters: list # of string or None
     _pattern: list # of int
     _max_letters_per_column: int
+    _cells: list # of (int, int)
+    _num_columns: list # of int
+    _grid: list # of list of string
+    _num_rows: int
+    _rendered: Union[str, None]
 
     def __init__(self, pattern: list, max_letters_per_column: int) -> None:
         self._letters = []
         self._pattern = pattern
         self._max_letters_per_column = max_letters_per_column
+        self._build_layout()
+
+    def _build_layout(self) -> None:
+        """
+        各文字の位置を (行, 列) として事前に計算する。
+        _num_columns[i] は i 文字が追加された時点で表示される列の数。
+        """
+        self._cells = []
+        self._num_columns = [1]
+        c = 0
+        j = 0
+        c_j = 0
+        for length in self._pattern:
+            for _ in range(length):
+                self._cells.append((c_j, c))
+                j += 1
+                c_j += 1
+                if j >= length:
+                    c += 1
+                    j = 0
+                    c_j = 0
+                elif c_j >= self._max_letters_per_column:
+                    c += 1
+                    c_j = 0
+                self._num_columns.append(c + 1)
+        total_rows = max([r + 1 for r, _ in self._cells], default=0)
+        self._grid = [["　"] * self._num_columns[-1] for _ in range(total_rows)]
+        self._num_rows = 0
+        self._rendered = None
     
     def add_letter(self) -> None:
+        row, column = self._cells[len(self._letters)]
         self._letters.append(None)
+        self._grid[row][-1 - column] = "◯"
+        self._num_rows = max(self._num_rows, row + 1)
+        self._rendered = None
     
     def set_letter(self, letter: str, index: int) -> None:
         if index > len(self._letters):
             raise InvalidPageError()
         elif index == len(self._letters):
+            row, _ = self._cells[index]
             self._letters.append(letter)
+            self._num_rows = max(self._num_rows, row + 1)
         else:
             self._letters[index] = letter
+        row, column = self._cells[index]
+        self._grid[row][-1 - column] = letter
+        self._rendered = None
     
     def get_letters(self) -> list:
         return self._letters
     
     def generate_vertical(self) -> str:
         """
-        縦書き表記の文字列を返す。
+        縦書き表記の文字列を返す。変更がなければ前回の結果を返す。
         """
-        columns = [[]]
-            
-        c = 0
-        p_i = 0
-        j = 0
-        c_j = 0
-        for i in range(len(self._letters)):
-            columns[c].append(self._letters[i])
-            j += 1
-            c_j += 1
-            if j >= self._pattern[p_i]:
-                columns.append([])
-                c += 1
-                p_i += 1
-                j = 0
-                c_j = 0
-            elif c_j >= self._max_letters_per_column:
-                columns.append([])
-                c += 1
-                c_j = 0
-        
-        ret_str = ""
-        for i in range(max(len(column) for column in columns)):
-            row = []
-            for j in reversed(range(len(columns))):
-                if len(columns[j]) <= i:
-                    row.append("　")
-                else:
-                    if columns[j][i] is None:
-                        row.append("◯")
-                    else:
-                        row.append(columns[j][i])
-            ret_str += " ".join(row) + "\n"
-
-        return ret_str.rstrip("\n")
\ No newline at end of file
+        if self._rendered is None:
+            start = len(self._grid[0]) - self._num_columns[len(self._letters)] \
+                                                    if self._grid else 0
+            self._rendered = "\n".join(
+                " ".join(self._grid[i][start:]) for i in range(self._num_rows)
+            )
+        return self._rendered
@@ -3,89 +3,239 @@
 import json
 import os
 import random
-from typing import Dict, List, Union
+from collections import deque
+from typing import Deque, Dict, Iterable, List, NamedTuple, Tuple, Union
+
+from source.content_store import CONTENT_STORE
 
 
 DEFAULT_BEST_THEMES = os.path.join(os.path.dirname(__file__), "themes.json")
+DEFAULT_RECENT_WINDOW = 8
+MAX_RESAMPLE = 3
 
 class InvalidThemesError(Exception):
     pass
 
+class AliasTable(NamedTuple):
+    """
+    Vose のエイリアス法による重み付き抽選表。抽選は一様乱数2回の定数時間で済む。
+    """
+    indexes: Tuple[int, ...] # of theme index
+    prob: Tuple[float, ...]
+    alias: Tuple[int, ...] # of position in indexes
+
+    def sample(self, rng: random.Random) -> int:
+        k = rng.randrange(len(self.indexes))
+        if rng.random() < self.prob[k]:
+            return self.indexes[k]
+        return self.indexes[self.alias[k]]
+
+class ThemeSet(NamedTuple):
+    themes: Tuple[str, ...]
+    weighted: bool
+    sampler: AliasTable
+    categories: Dict[str, AliasTable] # of category: table
+
 class Best:
+    """
+    お題の山札。重みもカテゴリも使わない場合はシャッフルした山札から重複なしで引き、
+    尽きたときに引き直す。直近に出したお題は recent_window 個まで覚えておき、
+    引き直した山札の最後に回すか、重み付き抽選では引き直す。
+    山札と履歴はセッションの carryover に置き、同じチャンネルでゲームを起動し直しても引き継ぐ。
+    """
     _current_theme: str
-    _th_list: List[str]
-    num_theme: int
+    _th_path: Union[str, None]
+    _theme_set: Union[ThemeSet, None]
+    _deck: List[int] # of theme index, drawn from the end
+    _recent: Deque[str]
 
-    def __init__(self, th_path: Union[str, None]) -> None:
-        self.num_theme = 0
+    def __init__(self, th_path: Union[str, None], recent_window: int = DEFAULT_RECENT_WINDOW) -> None:
         self._current_theme = ""
-        self._load_theme_list(th_path)
-    
-    def _load_theme_list(self, th_path: Union[str, None]) -> None:
-        if th_path is None:
-            th_path = DEFAULT_BEST_THEMES
-        
-        with open(th_path, "r") as f:
-            try:
-                self._th_list: List[dict] = json.loads(f.read())["theme_list"]
-            except KeyError:
-                raise InvalidThemesError()
-        
-        self.num_theme = len(self._th_list)
-    
-    def _set_theme(self, i: Union[int, None]) -> None:
-        if i is None:
-            i = random.randint(0, len(self._th_list) - 1)
-        elif i >= len(self._th_list):
-            raise IndexError()
+        self._th_path = th_path
+        self._theme_set = None
+        self._deck = []
+        self._recent = deque(maxlen=recent_window)
+        get_theme_list(th_path)
 
-        self._current_theme = self._th_list[i]
-    
-    def get_random_theme(self) -> str:
-        self._set_theme(None)
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_theme_set"] = None
+        return state
+
+    def get_th_path(self) -> Union[str, None]:
+        return self._th_path
+
+    @property
+    def num_theme(self) -> int:
+        return len(get_theme_list(self._th_path).themes)
+
+    def get_categories(self) -> List[str]:
+        return list(get_theme_list(self._th_path).categories.keys())
+
+    def _shuffle(self, theme_set: ThemeSet) -> None:
+        deck = list(range(len(theme_set.themes)))
+        random.shuffle(deck)
+        recent = set(self._recent)
+        self._deck = [i for i in deck if theme_set.themes[i] in recent] \
+                   + [i for i in deck if theme_set.themes[i] not in recent]
 
+    def _sample(self, theme_set: ThemeSet, table: AliasTable) -> int:
+        i = table.sample(random)
+        for _ in range(MAX_RESAMPLE):
+            if theme_set.themes[i] not in self._recent:
+                break
+            i = table.sample(random)
+        return i
+
+    def get_random_theme(self, category: Union[str, None] = None) -> str:
+        """
+        category: カテゴリ名。指定した場合はそのカテゴリの中から重みに従って抽選する。
+        """
+        theme_set = get_theme_list(self._th_path)
+        if theme_set is not self._theme_set:
+            if self._theme_set is None:
+                # スナップショットから復元した直後は山札をそのまま使う
+                self._deck = [i for i in self._deck if i < len(theme_set.themes)]
+            else:
+                # お題ファイルが読み直された場合は山札を作り直す
+                self._deck = []
+            self._theme_set = theme_set
+
+        if category is not None and category not in theme_set.categories:
+            print(f"unknown theme category: {category}")
+            category = None
+
+        if category is not None:
+            i = self._sample(theme_set, theme_set.categories[category])
+        elif theme_set.weighted:
+            i = self._sample(theme_set, theme_set.sampler)
+        else:
+            if len(self._deck) == 0:
+                self._shuffle(theme_set)
+            i = self._deck.pop()
+
+        self._current_theme = theme_set.themes[i]
+        self._recent.append(self._current_theme)
         return self._current_theme
 
 
 class BestOptions:
-    _option_dict: Dict[int, Union[str, None]]
+    """
+    各プレイヤーの回答を席番号順に並べた枠。ゲーム中は同じインスタンスを reset して使い回す。
+    """
+    _options: List[Union[str, None]] # of seat index: text
     _answerer_id: int
+    _num_set: int
 
     def __init__(self, len: int):
-        self._option_dict = {}
-        for i in range(len):
-            self._option_dict[i] = None
+        self._options = []
         self._answerer_id = 0
-    
-    def set_answerer_id(self, i: int) -> None:
-        if not i in list(self._option_dict.keys()):
-            raise IndexError()
-        
-        self._answerer_id = i
+        self._num_set = 0
+        self.reset(len)
 
+    def reset(self, size: int, answerer_id: int = 0) -> None:
+        if len(self._options) == size:
+            for i in range(size):
+                self._options[i] = None
+        else:
+            self._options = [None] * size
+        self._answerer_id = answerer_id
+        self._num_set = 0
+    
     def set_option(self, i: int, text: str) -> None:
-        if not i in list(self._option_dict.keys()):
+        if not 0 <= i < len(self._options):
             raise IndexError()
         
-        self._option_dict[i] = text
+        if i != self._answerer_id and self._options[i] is None:
+            self._num_set += 1
+        self._options[i] = text
     
     def all_set(self) -> bool:
-        ret = True
-        for i in range(len(self._option_dict)):
-            if i == self._answerer_id:
-                continue
-            if self._option_dict.get(i) is None:
-                ret = False
+        return self._num_set == len(self._options) - 1
+
+    def get_unset_ids(self) -> List[int]:
+        return [
+            i for i, option in enumerate(self._options)
+            if i != self._answerer_id and option is None
+        ]
 
-        return ret
+    def count_set(self) -> int:
+        return self._num_set
 
     def list_random(self) -> List[str]:
         assert self.all_set()
 
-        tmp: List[str] = []
-        for i in range(len(self._option_dict)):
-            if i == self._answerer_id:
-                continue
-            tmp.append(self._option_dict.get(i))
+        tmp: List[str] = [
+            option for i, option in enumerate(self._options) if i != self._answerer_id
+        ]
         random.shuffle(tmp)
         return tmp
+
+def get_theme_list(th_path: Union[str, None]) -> ThemeSet:
+    if th_path is None:
+        th_path = DEFAULT_BEST_THEMES
+    return CONTENT_STORE.get("bfs_theme_set", th_path, parse_theme_list)
+
+def parse_theme_list(text: str) -> ThemeSet:
+    """
+    theme_list の要素は文字列か、{"theme": str, "category": str, "weight": 数値} の形の辞書。
+    category と weight は省略できる。
+    """
+    try:
+        th_list = json.loads(text)["theme_list"]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidThemesError()
+    if not isinstance(th_list, list) or len(th_list) == 0:
+        raise InvalidThemesError()
+
+    themes: List[str] = []
+    weights: List[float] = []
+    categories: Dict[str, List[int]] = {}
+    for i, th in enumerate(th_list):
+        category = None
+        weight = 1.0
+        if isinstance(th, dict):
+            category = th.get("category")
+            weight = th.get("weight", 1.0)
+            th = th.get("theme")
+        if not isinstance(th, str) \
+                or not (category is None or isinstance(category, str)) \
+                or isinstance(weight, bool) or not isinstance(weight, (int, float)) \
+                or not 0 < weight < float("inf"):
+            raise InvalidThemesError()
+        themes.append(th)
+        weights.append(float(weight))
+        if category is not None:
+            categories.setdefault(category, []).append(i)
+
+    return ThemeSet(
+        themes=tuple(themes),
+        weighted=any(w != 1.0 for w in weights),
+        sampler=build_alias_table(range(len(themes)), weights),
+        categories={
+            category: build_alias_table(indexes, [weights[i] for i in indexes])
+            for category, indexes in categories.items()
+        },
+    )
+
+def build_alias_table(indexes: Iterable[int], weights: List[float]) -> AliasTable:
+    indexes = tuple(indexes)
+    n = len(indexes)
+    total = sum(weights)
+    scaled = [w * n / total for w in weights]
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [k for k, p in enumerate(scaled) if p < 1.0]
+    large = [k for k, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    # 残りは丸め誤差を除いて確率1
+    return AliasTable(indexes, tuple(prob), tuple(alias))
@@ -1,16 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import random
-from typing import Callable, Dict, List, Tuple, Union
+from array import array
+from types import MappingProxyType
+from typing import Any, Dict, Hashable, List, Mapping, Tuple, Union
 
 import discord
 
 from source.command import Command
-from source.game_controller import GameController, OnMessageResponse, COMMANDS_B, ALWAYS_ALLOWED_COMMANDS_B
+from source.game_controller import GameController, OnMessageResponse, COMMANDS_B, ALWAYS_ALLOWED_COMMANDS_B, HANDLERS_B
+from source.member_directory import MemberDirectory
+from source.router import CommandRouter
 from source.bfs.player import PlayerMaster
 from source.bfs.best import Best, BestOptions
 
 MAX_CYCLES = 5
+DEFAULT_OPTION = "（パス）"
 ICONS_BF = {
     "MAIN": ":two_women_holding_hands:",
     "CAUT": ":exclamation:",
@@ -21,7 +26,7 @@ COMMANDS_BF = {
     "LEAVE": Command("!leave", "ゲーム参加メンバーリストから除外されます。"),
     "RESETMMB": Command("!reset_players", "ゲーム参加メンバーリストを全消去します。"),
     "SETCYCLES": Command("!set_cycles", "何周するかを設定します。"),
-    "START": Command("!start_game", "ゲームを開始します。"),
+    "START": Command("!start_game", "ゲームを開始します。カテゴリ名を半角スペースに続けて打ち込むと、そのカテゴリのお題だけが出題されます。"),
     "QUITGM": Command("!quit_game", "ゲームを強制終了します。"),
     "SUBM": Command("!submit", "お題に対する回答を送信します。"),
     "ENDSM": Command("!end_submit", "回答のフェーズを終了し、選択肢開示フェーズに移行します。"),
@@ -38,6 +43,9 @@ ALLOWED_COMMANDS_PER_PHASE_BF = {
         "LEAVE",
         "RESETMMB",
         "SETCYCLES",
+        "LNCG",
+        "SETCH",
+        "RELOADMMB",
         "START",
     ],
     PHASES["R"]: [
@@ -54,13 +62,28 @@ ALWAYS_ALLOWED_COMMANDS_BF = [
     "SHOWPL",
 ]
 ALWAYS_ALLOWED_COMMANDS_BF += ALWAYS_ALLOWED_COMMANDS_B
+HANDLERS_BF = {
+    **HANDLERS_B,
+    "SHOWPL": "show_players",
+    "JOIN": "join",
+    "LEAVE": "leave",
+    "RESETMMB": "reset_players",
+    "SETCYCLES": "set_cycles",
+    "START": "start_game",
+    "QUITGM": "quit_game",
+    "SUBM": "submit",
+    "ENDSM": "end_submit",
+    "NEXT": "next",
+}
 
 class BFSController(GameController):
-    allowed_commands_per_phase: Dict[str, str]
-    commands_dictionary: Dict[str, Command]
-    function_dictionary: Dict[str, Callable]
+    commands_dictionary: Mapping[str, Command] = MappingProxyType({**COMMANDS_BF, **COMMANDS_B})
+    router: CommandRouter = CommandRouter(
+        commands_dictionary, HANDLERS_BF,
+        ALLOWED_COMMANDS_PER_PHASE_BF, ALWAYS_ALLOWED_COMMANDS_BF,
+    )
     gamech_id: int
-    members: List[discord.Member]
+    members: MemberDirectory
     playermaster: PlayerMaster
     
     phase: str
@@ -68,7 +91,9 @@ class BFSController(GameController):
     best_options: Union[BestOptions, None]
 
     current_theme: Union[str, None]
-    answerer_id_queue: List[int]
+    category: Union[str, None]
+    answerer_schedule: array # of seat index
+    turn: int
     num_cycle: int
     options_all_set_notified: bool
 
@@ -76,42 +101,26 @@ class BFSController(GameController):
         super().__init__()
         self.best = Best(th_path)
         self.best_options = None
+        self.category = None
         self.num_cycle = 1
         self.options_all_set_notified = False
 
-    def initialize(self, get_all_members: Callable, gamech_id: int):
-        self.get_all_members = get_all_members
+    def initialize(self, members: MemberDirectory, gamech_id: int):
         self.gamech_id = gamech_id
-        self.members = [member for member in self.get_all_members()]
+        self.members = members
         self.playermaster = PlayerMaster()
 
-        self.commands_dictionary = COMMANDS_BF
-        self.commands_dictionary.update(COMMANDS_B)
-
-        self.allowed_commands_per_phase = {}
-        for p in PHASES.values():
-            self.allowed_commands_per_phase[p] = []
-            for c in ALLOWED_COMMANDS_PER_PHASE_BF[p] + ALWAYS_ALLOWED_COMMANDS_BF:
-                self.allowed_commands_per_phase[p]\
-                                .append(self.commands_dictionary[c].get_command())
-
-        self.function_dictionary = {
-            self.commands_dictionary["HLP"].get_command(): self.help,
-            self.commands_dictionary["SHOWPL"].get_command(): self.show_players,
-            self.commands_dictionary["JOIN"].get_command(): self.join,
-            self.commands_dictionary["LEAVE"].get_command(): self.leave,
-            self.commands_dictionary["RESETMMB"].get_command(): self.reset_players,
-            self.commands_dictionary["SETCYCLES"].get_command(): self.set_cycles,
-            self.commands_dictionary["START"].get_command(): self.start_game,
-            self.commands_dictionary["QUITGM"].get_command(): self.quit_game,
-            self.commands_dictionary["SUBM"].get_command(): self.submit,
-            self.commands_dictionary["ENDSM"].get_command(): self.end_submit,
-            self.commands_dictionary["NEXT"].get_command(): self.next,
-        }
-
         self.phase = PHASES["S"]
 
         print("initialization ok")
+
+    def use_carryover(self, carryover: Dict[str, Any]) -> None:
+        # 直近のお題の履歴をチャンネルごとに残し、ゲームを起動し直しても同じお題が続かないようにする
+        best = carryover.get("bfs_best")
+        if best is None or best.get_th_path() != self.best.get_th_path():
+            carryover["bfs_best"] = self.best
+        else:
+            self.best = best
         
     def help(self, _, author: discord.Member) -> OnMessageResponse:
         help_str = "\n".join([
@@ -165,20 +174,30 @@ class BFSController(GameController):
             ret_mem = author.name
         return OnMessageResponse([(ret_mem, ret_mes)])
 
-    def start_game(self, *_) -> OnMessageResponse:        
+    def start_game(self, args_str: str, author: discord.Member) -> OnMessageResponse:
+        category = args_str.strip() or None
+        if category is not None and category not in self.best.get_categories():
+            ret_mes = f"{ICONS_BF['CAUT']} カテゴリ「{category}」のお題はありません。\n" \
+                    + "カテゴリ一覧：" + ("、".join(self.best.get_categories()) or "なし")
+            return OnMessageResponse([(author.name, ret_mes)])
+        self.category = category
+
         ret: List[Tuple[Union[str, None], str]] = []
         # 共有情報
-        ret_mes = f"{ICONS_BF['MAIN']} **ゲームを開始します！**\n" \
-                + "参加者一覧：\n"
+        ret_mes = f"{ICONS_BF['MAIN']} **ゲームを開始します！**\n"
+        if category is not None:
+            ret_mes += f"カテゴリ：{category}\n"
+        ret_mes += "参加者一覧：\n"
         for p in self.playermaster.get_players():
             ret_mes += f"- {p.get_name()}\n"
         self.phase = PHASES["R"]
         ret.append((None, ret_mes))
 
-        # 回答者IDのキューを作成
-        rand_id_queue = list(range(self.playermaster.len_players()))
-        random.shuffle(rand_id_queue)
-        self.answerer_id_queue = rand_id_queue * self.num_cycle
+        # 回答者の順番を作成
+        order = array("i", range(self.playermaster.len_players()))
+        random.shuffle(order)
+        self.answerer_schedule = order * self.num_cycle
+        self.turn = 0
 
         # 全員へ操作方法の通知
         cmd = self.commands_dictionary["SUBM"].get_command()
@@ -192,15 +211,22 @@ class BFSController(GameController):
             ret.append((p.get_name(), ret_mes))
         
         # ターン進行処理
-        self.current_theme = self.best.get_random_theme()
-        self.best_options = BestOptions(self.playermaster.len_players())
-        answerer = self.playermaster.get_players()[self.answerer_id_queue[0]]
-        self.best_options.set_answerer_id(self.answerer_id_queue[0])
-        ret_mes = f"{ICONS_BF['MAIN']} お題：{answerer.get_name()}さんの" \
-                + f"「ベスト'{self.current_theme}'」"
-        ret.append((None, ret_mes))
+        ret.append((None, self.start_turn()))
         
         return OnMessageResponse(ret)
+
+    def start_turn(self) -> str:
+        """
+        現在のターンのお題を引いて回答欄を空にし、お題の告知メッセージを返す。
+        """
+        self.current_theme = self.best.get_random_theme(self.category)
+        answerer_id = self.answerer_schedule[self.turn]
+        if self.best_options is None:
+            self.best_options = BestOptions(self.playermaster.len_players())
+        self.best_options.reset(self.playermaster.len_players(), answerer_id)
+        answerer = self.playermaster.get_players()[answerer_id]
+        return f"{ICONS_BF['MAIN']} お題：{answerer.get_name()}さんの" \
+             + f"「ベスト'{self.current_theme}'」"
     
     def quit_game(self, *_) -> OnMessageResponse:
         ret_mes = f"{ICONS_BF['MAIN']} ゲームが強制終了されました。\n" \
@@ -209,18 +235,12 @@ class BFSController(GameController):
         return OnMessageResponse([(None, ret_mes)])
     
     def submit(self, args_str: str, author: discord.Member) -> OnMessageResponse:
-        is_player = False
-        player_id = 0
-        for i, player in enumerate(self.playermaster.get_players()):
-            if player.get_name() == author.name:
-                is_player = True
-                player_id = i
-        
-        if not is_player:
+        player_id = self.playermaster.get_seat(author.name)
+        if player_id is None:
             ret_mes = f"{ICONS_BF['CAUT']} ゲームに参加していません！"
             return OnMessageResponse([(author.name, ret_mes)])
     
-        if player_id == self.answerer_id_queue[0]:
+        if player_id == self.answerer_schedule[self.turn]:
             ret_mes = f"{ICONS_BF['CAUT']} あなたが回答者です！"
             return OnMessageResponse([(author.name, ret_mes)])
         
@@ -228,7 +248,8 @@ class BFSController(GameController):
         
         ret: List[Tuple[Union[str, None], str]] = []
 
-        ret_mes = f"{ICONS_BF['MAIN']} 入力を受け付けました！"
+        ret_mes = f"{ICONS_BF['MAIN']} 入力を受け付けました！" \
+                + f"（{self.best_options.count_set()}/{self.playermaster.len_players() - 1}人が投稿済み）"
         ret.append((author.name, ret_mes))
 
         if self.best_options.all_set() and not self.options_all_set_notified:
@@ -260,25 +281,42 @@ class BFSController(GameController):
     def next(self, *_) -> OnMessageResponse:
         self.options_all_set_notified = False
         
-        if len(self.answerer_id_queue) == 1:
+        if self.turn + 1 >= len(self.answerer_schedule):
             ret_mes = f"{ICONS_BF['CAUT']} ゲーム終了で～す！"
             self.phase = PHASES["S"]
             return OnMessageResponse([(None, ret_mes)])
         
         ret: List[Tuple[Union[str, None], str]] = []
 
+        self.turn += 1
+        ret.append((None, self.start_turn()))
 
-        self.current_theme = self.best.get_random_theme()
-        self.best_options = BestOptions(self.playermaster.len_players())
+        self.phase = PHASES["R"]
 
-        self.answerer_id_queue = self.answerer_id_queue[1:]
+        return OnMessageResponse(ret)
 
-        answerer = self.playermaster.get_players()[self.answerer_id_queue[0]]
-        self.best_options.set_answerer_id(self.answerer_id_queue[0])
-        ret_mes = f"{ICONS_BF['MAIN']} お題：{answerer.get_name()}さんの" \
-                + f"「ベスト'{self.current_theme}'」"
-        ret.append((None, ret_mes))
+    def get_turn_key(self) -> Union[Hashable, None]:
+        if self.phase in (PHASES["R"], PHASES["A"]):
+            return (self.phase, self.turn)
+        return None
 
-        self.phase = PHASES["R"]
+    def pending_players(self) -> List[str]:
+        if self.phase != PHASES["R"]:
+            return []
+        players = self.playermaster.get_players()
+        return [players[i].get_name() for i in self.best_options.get_unset_ids()]
 
-        return OnMessageResponse(ret)
+    def on_deadline(self) -> OnMessageResponse:
+        if self.phase == PHASES["A"]:
+            ret_mes = f"{ICONS_BF['CAUT']} 締め切りを過ぎたため、次のターンに進みます。"
+            res = self.next(None, None)
+            res.message_list.insert(0, (None, ret_mes))
+            return res
+        if self.phase != PHASES["R"]:
+            return OnMessageResponse([])
+        for i in self.best_options.get_unset_ids():
+            self.best_options.set_option(i, DEFAULT_OPTION)
+        ret_mes = f"{ICONS_BF['CAUT']} 締め切りを過ぎたため、未投稿の回答を「{DEFAULT_OPTION}」として進めます。"
+        res = self.end_submit(None, None)
+        res.message_list.insert(0, (None, ret_mes))
+        return res
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import List, Union
+from typing import Dict, List, Union
 
 
 class UnknownPlayerError(Exception):
@@ -17,29 +17,31 @@ class Player:
 
 class PlayerMaster:
     _player_list: List[Player]
+    _seat_map: Dict[str, int] # of name: seat index
 
     def __init__(self):
         self._player_list = []
+        self._seat_map = {}
     
     def add_player(self, player_name: str) -> bool:
-        ok = True
-        for player in self._player_list:
-            if player.get_name() == player_name:
-                ok = False
-        if ok:
-            self._player_list.append(Player(player_name))
-        return ok
+        if player_name in self._seat_map:
+            return False
+        self._seat_map[player_name] = len(self._player_list)
+        self._player_list.append(Player(player_name))
+        return True
     
     def remove_player(self, player_name: str) -> bool:
-        found = False
-        for i, player in enumerate(self._player_list):
-            if player.get_name() == player_name:
-                self._player_list.pop(i)
-                found = True
-        return found
+        if player_name not in self._seat_map:
+            return False
+        self._player_list.pop(self._seat_map[player_name])
+        self._seat_map = {
+            player.get_name(): i for i, player in enumerate(self._player_list)
+        }
+        return True
     
     def remove_all(self) -> None:
         self._player_list = []
+        self._seat_map = {}
     
     def display_players(self) -> str:
         ret_str = "\n".join([
@@ -49,14 +51,16 @@ class PlayerMaster:
         return ret_str
     
     def get_player(self, player_name: str) -> Union[Player, None]:
-        for player in self._player_list:
-            if player.get_name() == player_name:
-                return player
-        return None
+        seat = self._seat_map.get(player_name)
+        if seat is None:
+            return None
+        return self._player_list[seat]
+
+    def get_seat(self, player_name: str) -> Union[int, None]:
+        return self._seat_map.get(player_name)
 
     def get_players(self) -> List[Player]:
         return self._player_list
 
     def len_players(self) -> int:
         return len(self._player_list)
-
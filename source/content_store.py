@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import os
+import pickle
+import time
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+DEFAULT_WATCH_INTERVAL = 10.0
+
+class ReloadStat:
+    reloads: int
+    failures: int
+    last_seconds: Union[float, None]
+    last_error: Union[str, None]
+    failed_stamp: Union[Tuple[int, int], None]
+
+    def __init__(self) -> None:
+        self.reloads = 0
+        self.failures = 0
+        self.last_seconds = None
+        self.last_error = None
+        self.failed_stamp = None
+
+class ContentStore:
+    """
+    レイアウトやお題などのJSONファイルを一度だけ読み込み、変更不可な形で全セッションに共有する。
+    cache_dir が設定されている場合は解析済みの内容をパスと更新時刻をキーとして保存し、
+    次回起動時にはJSONの解析を省略する。
+    reload_changed で更新されたファイルを読み直し、レコードを丸ごと差し替える。
+    """
+    _entries: Dict[Tuple[str, str], Any] # of (kind, path): records
+    _sources: Dict[Tuple[str, str], Tuple[Tuple[int, int], Callable[[str], Any]]]
+    _cache_dir: Union[str, None]
+    reload_stats: Dict[Tuple[str, str], ReloadStat]
+
+    def __init__(self, cache_dir: Union[str, None] = None) -> None:
+        self._entries = {}
+        self._sources = {}
+        self._cache_dir = cache_dir
+        self.reload_stats = {}
+
+    def set_cache_dir(self, cache_dir: Union[str, None]) -> None:
+        self._cache_dir = cache_dir
+
+    def get(self, kind: str, path: str, parse: Callable[[str], Any]) -> Any:
+        """
+        kind: 内容の種類（キャッシュファイル名の区別に使う）
+        parse: ファイルの内容を受け取り、検証したうえで変更不可なレコードを返す関数
+        """
+        records = self._entries.get((kind, path))
+        if records is None:
+            stamp = file_stamp(path)
+            records = self._load(kind, path, parse, stamp)
+            self._sources[(kind, path)] = (stamp, parse)
+            self._entries[(kind, path)] = records
+        return records
+
+    def reload_changed(self) -> List[Tuple[str, str]]:
+        """
+        読み込み済みのファイルのうち更新されたものを読み直し、差し替えたキーのリストを返す。
+        検証に失敗した場合は以前の内容を使い続ける。
+        """
+        reloaded = []
+        for key, (old_stamp, parse) in list(self._sources.items()):
+            kind, path = key
+            stat = self.reload_stats.setdefault(key, ReloadStat())
+            stamp = None
+            try:
+                stamp = file_stamp(path)
+                if stamp == old_stamp or stamp == stat.failed_stamp:
+                    continue
+                start = time.perf_counter()
+                records = self._load(kind, path, parse, stamp)
+            except Exception as e:
+                print(f"failed to reload {path}: {e!r}")
+                stat.failures += 1
+                stat.last_error = repr(e)
+                stat.failed_stamp = stamp
+                continue
+            self._sources[key] = (stamp, parse)
+            self._entries[key] = records
+            stat.reloads += 1
+            stat.last_seconds = time.perf_counter() - start
+            stat.last_error = None
+            stat.failed_stamp = None
+            print(f"reloaded {path} in {stat.last_seconds * 1000:.1f} ms")
+            reloaded.append(key)
+        return reloaded
+
+    def _load(self, kind: str, path: str, parse: Callable[[str], Any], stamp: Tuple[int, int]) -> Any:
+        cache_path = self._cache_path(kind, path)
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    cached_stamp, records = pickle.load(f)
+                if cached_stamp == stamp:
+                    return records
+            except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+                pass
+
+        with open(path, "r") as f:
+            records = parse(f.read())
+
+        if cache_path is not None:
+            try:
+                os.makedirs(self._cache_dir, exist_ok=True)
+                tmp_path = cache_path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump((stamp, records), f)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                print(f"failed to write content cache for {path}: {e!r}")
+        return records
+
+    def _cache_path(self, kind: str, path: str) -> Union[str, None]:
+        if self._cache_dir is None:
+            return None
+        digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self._cache_dir, f"{kind}_{digest}.pickle")
+
+def file_stamp(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+class ContentWatcher:
+    """
+    一定間隔でファイルの更新時刻を調べ、変更があれば ContentStore に読み直させる。
+    読み直しはイベントループを止めないよう別スレッドで行う。
+    """
+    _store: ContentStore
+    _interval: float
+
+    def __init__(self, store: ContentStore, interval: float = DEFAULT_WATCH_INTERVAL) -> None:
+        self._store = store
+        self._interval = interval
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._interval)
+            await loop.run_in_executor(None, self._store.reload_changed)
+
+CONTENT_STORE = ContentStore()
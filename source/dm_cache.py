@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+from collections import OrderedDict
+from typing import Callable, Dict, Union
+
+import discord
+
+DEFAULT_MAX_SIZE = 1024
+
+class DMChannelCache:
+    """
+    ユーザIDをキーとしてDMチャンネルを保持するLRUキャッシュ。
+    path が与えられた場合はユーザIDとチャンネルIDの対応を保存し、再起動後に復元する。
+    """
+    _channels: "OrderedDict[int, discord.abc.Messageable]"
+    _max_size: int
+    _path: Union[str, None]
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, path: Union[str, None] = None) -> None:
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self._channels = OrderedDict()
+        self._max_size = max_size
+        self._path = path
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def get(self, user_id: int) -> Union[discord.abc.Messageable, None]:
+        channel = self._channels.get(user_id)
+        if channel is not None:
+            self._channels.move_to_end(user_id)
+        return channel
+
+    def put(self, user_id: int, channel: discord.abc.Messageable) -> None:
+        self._channels[user_id] = channel
+        self._channels.move_to_end(user_id)
+        while len(self._channels) > self._max_size:
+            self._channels.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._channels.pop(user_id, None)
+
+    def load(self, get_partial_messageable: Callable) -> None:
+        """
+        保存されたチャンネルIDから送信用のチャンネルを復元する。
+        """
+        if self._path is None or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, "r") as f:
+                id_map: Dict[str, int] = json.loads(f.read())
+        except (OSError, ValueError):
+            return
+        for user_id, channel_id in id_map.items():
+            self.put(int(user_id), get_partial_messageable(
+                channel_id, type=discord.ChannelType.private
+            ))
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+        id_map = {str(k): v.id for k, v in self._channels.items()}
+        with open(self._path, "w") as f:
+            f.write(json.dumps(id_map))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Dict
+
+from source.session import SessionRegistry
+
+DEFAULT_SWEEP_INTERVAL = 60.0
+# 直前に使われたセッションは予算を超えていても残す
+MIN_IDLE_SECONDS = 30.0
+
+class EvictionStat:
+    spilled: int
+    dropped: int
+    resident_bytes: int
+    spilled_bytes: int
+
+    def __init__(self) -> None:
+        self.spilled = 0
+        self.dropped = 0
+        self.resident_bytes = 0
+        self.spilled_bytes = 0
+
+class EvictionManager:
+    """
+    一定時間使われていないセッションを退避し、退避してから ttl 秒経ったものは破棄する。
+    memory_budget を超える場合は、使われてから時間の経っている順に退避し、
+    それでも超える場合は退避した順に破棄する。
+    メモリ上のセッションの大きさは直列化したときの大きさで見積もり、変更のなかったセッションは前回の値を使う。
+    """
+    _sessions: SessionRegistry
+    _idle: float
+    _ttl: float
+    _budget: int
+    stat: EvictionStat
+
+    def __init__(self, sessions: SessionRegistry, idle: float, ttl: float, memory_budget: int) -> None:
+        """
+        idle: 退避するまでの秒数（0 で時間による退避をしない）
+        ttl: 退避してから破棄するまでの秒数（0 で時間による破棄をしない）
+        memory_budget: セッション全体の大きさの上限のバイト数（0 で上限を設けない）
+        """
+        self._sessions = sessions
+        self._idle = idle
+        self._ttl = ttl
+        self._budget = memory_budget
+        self.stat = EvictionStat()
+
+    async def sweep(self, now: float) -> EvictionStat:
+        stat = EvictionStat()
+
+        if self._idle > 0:
+            for session in self._sessions:
+                if now - session.last_active < self._idle:
+                    break
+                if session.lock.locked():
+                    continue
+                if await self._sessions.spill(session.key) is not None:
+                    stat.spilled += 1
+
+        if self._ttl > 0:
+            for key, _, spilled_at in self._sessions.iter_spilled():
+                if now - spilled_at < self._ttl:
+                    break
+                self._sessions.drop(key)
+                stat.dropped += 1
+
+        resident_sizes: Dict[int, int] = {}
+        if self._budget > 0:
+            # 測っている間に読み戻されたセッションを破棄しないよう、退避中の一覧は測ったあとに取る
+            resident_sizes = await self._sessions.measure()
+            stat.resident_bytes = sum(resident_sizes.values())
+        spilled_sizes: Dict[int, int] = {}
+        for key, size, _ in self._sessions.iter_spilled():
+            spilled_sizes[key] = size
+        stat.spilled_bytes = sum(spilled_sizes.values())
+        if self._budget > 0:
+            for session in self._sessions:
+                if stat.resident_bytes + stat.spilled_bytes <= self._budget \
+                        or now - session.last_active < MIN_IDLE_SECONDS:
+                    break
+                if session.lock.locked():
+                    continue
+                size = await self._sessions.spill(session.key)
+                if size is None:
+                    continue
+                spilled_sizes[session.key] = size
+                stat.resident_bytes -= resident_sizes[session.key]
+                stat.spilled_bytes += size
+                stat.spilled += 1
+            # 退避している間に読み戻されたセッションは破棄しない
+            still_spilled = set(key for key, _, _ in self._sessions.iter_spilled())
+            for key in list(spilled_sizes.keys()):
+                if key not in still_spilled:
+                    stat.spilled_bytes -= spilled_sizes.pop(key)
+            for key in list(spilled_sizes.keys()):
+                if stat.resident_bytes + stat.spilled_bytes <= self._budget:
+                    break
+                self._sessions.drop(key)
+                stat.spilled_bytes -= spilled_sizes.pop(key)
+                stat.dropped += 1
+
+        self.stat.spilled += stat.spilled
+        self.stat.dropped += stat.dropped
+        self.stat.resident_bytes = stat.resident_bytes
+        self.stat.spilled_bytes = stat.spilled_bytes
+        return stat
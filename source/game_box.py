@@ -1,10 +1,24 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import Union
+import asyncio
+import time
+from typing import Dict, Hashable, List, Mapping, Tuple, Union
 
 import discord
 
-from source.game_controller import GameController
+from source.aap.letters import DEFAULT_LETTER_TABLE, load_letter_table
+from source.bfs.best import get_theme_list
+from source.content_store import CONTENT_STORE, ContentWatcher, DEFAULT_WATCH_INTERVAL
+from source.dm_cache import DMChannelCache, DEFAULT_MAX_SIZE
+from source.eviction import EvictionManager, DEFAULT_SWEEP_INTERVAL
+from source.game_controller import GameController, OnMessageResponse
+from source.journal import Journal, DEFAULT_SNAPSHOT_INTERVAL
+from source.member_directory import MemberDirectory
+from source.message_filter import MessageFilter
+from source.ntn.script import get_layout_list
+from source.session import Session, SessionRegistry
+from source.tab.archive import BookArchive
+from source.turn_timers import TurnTimers, TICK_SECONDS, NUDGE, is_current
 from source.tab.tab_controller import TABController
 from source.aap.aap_controller import AAPController
 from source.ntn.ntn_controller import NTNController
@@ -12,73 +26,347 @@ from source.bfs.bfs_controller import BFSController
 
 class GameBox(discord.Client):
     gamech_id: int
-    gc: GameController
-    edit_target_message: Union[discord.Message, None]
+    sessions: Union[SessionRegistry, None]
+    members: MemberDirectory
+    dm_cache: DMChannelCache
+    message_filter: MessageFilter
     ntn_lo_path: Union[str, None]
     bfs_th_path: Union[str, None]
+    aap_letter_table: Mapping[str, str]
+    tab_archive: Union[BookArchive, None]
+    content_watch_interval: float
+    content_watch_task: Union[asyncio.Task, None]
+    journal: Union[Journal, None]
+    snapshot_interval: float
+    snapshot_task: Union[asyncio.Task, None]
+    turn_timers: Union[TurnTimers, None]
+    auto_advance: bool
+    turn_timer_task: Union[asyncio.Task, None]
+    session_idle: float
+    session_ttl: float
+    memory_budget: int
+    eviction: Union[EvictionManager, None]
+    eviction_task: Union[asyncio.Task, None]
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.sessions = None
+        self.members = MemberDirectory(self.get_all_members)
+        self.dm_cache = DMChannelCache()
+        self.message_filter = MessageFilter()
+        self.ntn_lo_path = None
+        self.bfs_th_path = None
+        self.aap_letter_table = DEFAULT_LETTER_TABLE
+        self.tab_archive = None
+        self.content_watch_interval = DEFAULT_WATCH_INTERVAL
+        self.content_watch_task = None
+        self.journal = None
+        self.snapshot_interval = DEFAULT_SNAPSHOT_INTERVAL
+        self.snapshot_task = None
+        self.turn_timers = None
+        self.auto_advance = False
+        self.turn_timer_task = None
+        self.session_idle = 0.0
+        self.session_ttl = 0.0
+        self.memory_budget = 0
+        self.eviction = None
+        self.eviction_task = None
+
+    async def setup_hook(self) -> None:
+        # 再接続のたびに呼ばれる on_ready ではなく、ここで一度だけセッションを作る
+        self.sessions = SessionRegistry(
+            self.gamech_id,
+            self.create_controller,
+            self.members,
+            self.journal,
+        )
+        # 再生で完成した本を保存し直さないよう、再生が終わるまで保存先を外しておく
+        tab_archive, self.tab_archive = self.tab_archive, None
+        num_replayed = self.sessions.restore()
+        self.tab_archive = tab_archive
+        if num_replayed > 0:
+            print(f"replayed {num_replayed} journal entries")
+        self.sessions.get_or_create(self.gamech_id)
+
+        for session in self.sessions:
+            self.on_session_load(session)
+        self.sessions.on_load = self.on_session_load
+        if self.turn_timers is not None:
+            self.sessions.on_unload = self.turn_timers.cancel
+            self.turn_timer_task = asyncio.create_task(self.run_turn_timers())
+        if self.session_idle > 0 or self.session_ttl > 0 or self.memory_budget > 0:
+            self.eviction = EvictionManager(
+                self.sessions, self.session_idle, self.session_ttl, self.memory_budget,
+            )
+            self.eviction_task = asyncio.create_task(self.run_eviction())
+        if self.content_watch_interval > 0:
+            watcher = ContentWatcher(CONTENT_STORE, self.content_watch_interval)
+            self.content_watch_task = asyncio.create_task(watcher.run())
+        if self.journal is not None:
+            self.journal.start()
+            self.snapshot_task = asyncio.create_task(self.run_snapshots())
+
+    def on_session_load(self, session: Session) -> None:
+        """
+        復元したセッションや退避から読み戻したセッションに、直列化しなかったものを付け直す。
+        """
+        if isinstance(session.gc, TABController):
+            session.gc.archive = self.tab_archive
+        if self.turn_timers is not None:
+            self.turn_timers.resume(session, time.time())
+
+    async def run_snapshots(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            await self.sessions.snapshot()
+
+    async def run_eviction(self) -> None:
+        while True:
+            await asyncio.sleep(DEFAULT_SWEEP_INTERVAL)
+            stat = await self.eviction.sweep(time.time())
+            if stat.spilled > 0 or stat.dropped > 0:
+                print(f"spilled {stat.spilled} and dropped {stat.dropped} idle sessions "
+                      f"({len(self.sessions)} in memory)")
+                self.print_command_counts()
+
+    def print_command_counts(self) -> None:
+        for cls in (GameController, TABController, AAPController, NTNController, BFSController):
+            router = cls.router
+            if router.dispatch_counts or router.reject_counts:
+                print(f"{cls.__name__}: {router.format_counts()}")
+
+    async def run_turn_timers(self) -> None:
+        while True:
+            await asyncio.sleep(TICK_SECONDS)
+            fired = self.turn_timers.advance(time.time())
+            if fired:
+                await asyncio.gather(*[
+                    self.on_turn_timer(session, kind, turn_key)
+                    for session, kind, turn_key in fired
+                ], return_exceptions=True)
+
+    async def on_turn_timer(self, session: Session, kind: str, turn_key: Hashable) -> None:
+        async with session.lock:
+            if not is_current(session, turn_key):
+                # ロックを待っている間に次の段階に進んだ
+                return
+            await self.handle_turn_timer(session, kind)
+
+    async def handle_turn_timer(self, session: Session, kind: str) -> None:
+        if kind == NUDGE:
+            await self.send_messages(session, session.gc.on_nudge(session.deadline - time.time()))
+        elif self.auto_advance:
+            on_message_res = self.sessions.expire(session)
+            await self.deliver(session, on_message_res)
+            self.sessions.apply(session, on_message_res)
+            self.turn_timers.update(session, time.time())
+        else:
+            await self.send_messages(session, session.gc.on_overdue())
 
     async def on_ready(self) -> None:
         print("------------")
         print("Logged in as")
         print(self.user.name)
         print("------------")
-        self.gc = GameController()
-        self.gc.initialize(self.get_all_members, self.gamech_id)
-        self.edit_target_message = None
+        self.remove_lost_guilds()
+
+    async def on_resumed(self) -> None:
+        # 切断中のイベントは再送されるため、読み直すものはない
+        print("session resumed")
+
+    async def on_guild_join(self, guild: discord.Guild) -> None:
+        self.members.reload_guild(guild.id, guild.members)
+
+    async def on_guild_available(self, guild: discord.Guild) -> None:
+        # 再接続のたびにすべてのサーバについて呼ばれるため、食い違うサーバだけを読み直す。
+        # それ以外の変化は on_member_* と on_user_update で差分更新している
+        if not self.members.matches_guild(guild.id, guild.members):
+            self.members.reload_guild(guild.id, guild.members)
+            print(f"reloaded members of guild {guild.id}")
+
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        self.members.remove_guild(guild.id)
+
+    def remove_lost_guilds(self) -> None:
+        """
+        切断中に見えなくなったサーバのメンバーを取り除く。
+        見えているサーバは on_guild_available で確かめ済みなので、メンバーは走査しない。
+        """
+        guild_ids = set(guild.id for guild in self.guilds)
+        lost = self.members.get_guild_ids() - guild_ids
+        for guild_id in lost:
+            self.members.remove_guild(guild_id)
+        print(f"removed members of {len(lost)} lost guilds ({len(guild_ids)} guilds visible)")
 
     async def on_message(self, message: discord.Message) -> None:
-        on_message_res = self.gc.on_message(message)
+        if not self.message_filter.accept(message, self.user.id, self.sessions.has):
+            return
+        session = self.sessions.route(message)
+        # 送信を待つ間に同じセッションの別のコマンドが割り込まないよう、切り替えまでロックを持つ
+        async with session.lock:
+            await self.handle_message(session, message)
+
+    async def handle_message(self, session: Session, message: discord.Message) -> None:
+        on_message_res = self.sessions.dispatch(session, message)
+        if on_message_res.message_list and message.guild is not None:
+            self.sessions.bind_dm(message.author.id, session)
+        await self.deliver(session, on_message_res)
+        self.sessions.apply(session, on_message_res)
+        if self.turn_timers is not None:
+            self.turn_timers.update(session, time.time())
+
+    async def deliver(self, session: Session, on_message_res: OnMessageResponse) -> None:
         if on_message_res.edit:
-            if self.edit_target_message is not None:
-                await self.edit_target_message.edit(
-                    content=on_message_res.message_list[0][1]
-                )
+            target = session.editable_messages.get(on_message_res.editable_slot)
+            if target is not None:
+                await target.edit(content=on_message_res.message_list[0][1])
         else:
-            for i, msg in enumerate(on_message_res.message_list):
-                await self.send_message(msg[0], msg[1], i == on_message_res.register_editable_i)
-        if on_message_res.switch_game is not None:
-            if on_message_res.switch_game == 1:
-                # tab
-                self.gc = TABController()
-            elif on_message_res.switch_game == 2:
-                # aap
-                self.gc = AAPController()
-            elif on_message_res.switch_game == 3:
-                # ntn
-                self.gc = NTNController(self.ntn_lo_path)
-            elif on_message_res.switch_game == 4:
-                # bfs
-                self.gc = BFSController(self.bfs_th_path)
-            self.gc.initialize(self.get_all_members, self.gamech_id)
+            await self.send_messages(session, on_message_res)
+
+    async def on_member_join(self, member: discord.Member) -> None:
+        self.members.add(member)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
+        self.members.update(before, after)
+
+    async def on_user_update(self, before: discord.User, after: discord.User) -> None:
+        self.members.update_user(before, after)
+
+    async def on_member_remove(self, member: discord.Member) -> None:
+        self.members.remove(member)
+
+    def create_controller(self, switch_id: int) -> GameController:
+        if switch_id == 1:
+            # tab
+            return TABController(self.tab_archive)
+        elif switch_id == 2:
+            # aap
+            return AAPController(self.aap_letter_table)
+        elif switch_id == 3:
+            # ntn
+            return NTNController(self.ntn_lo_path)
+        elif switch_id == 4:
+            # bfs
+            return BFSController(self.bfs_th_path)
+        raise ValueError(switch_id)
     
+    async def send_messages(
+            self,
+            session: Session,
+            on_message_res: OnMessageResponse,
+        ) -> None:
+        """
+        宛先ごとに送信順を保ったまま、異なる宛先へは並行して送信する。
+        """
+        queues: Dict[Union[str, None], List[Tuple[int, Union[str, discord.File]]]] = {}
+        for i, (name, message) in enumerate(on_message_res.message_list):
+            queues.setdefault(name, []).append((i, message))
+        results = await asyncio.gather(*[
+            self._send_queue(session, name, queue, on_message_res)
+            for name, queue in queues.items()
+        ], return_exceptions=True)
+        for name, result in zip(queues.keys(), results):
+            if isinstance(result, Exception):
+                print(f"failed to send message to {name}: {result!r}")
+
+    async def _send_queue(
+            self,
+            session: Session,
+            name: Union[str, None],
+            queue: List[Tuple[int, Union[str, discord.File]]],
+            on_message_res: OnMessageResponse,
+        ) -> None:
+        for i, message in queue:
+            sent = await self.send_message(session, name, message)
+            if i == on_message_res.register_editable_i and sent is not None:
+                session.editable_messages[on_message_res.editable_slot] = sent
+
     async def send_message(
             self,
+            session: Session,
             name: Union[str, None],
             message: Union[str, discord.File],
-            register_editable: bool,
-        ) -> None:
-        channel: Union[discord.GroupChannel, discord.DMChannel]
+        ) -> Union[discord.Message, None]:
         if name is None:
-            channel = self.get_channel(self.gc.gamech_id)
-            await channel.send(message)
-        else:
-            for member in self.gc.members:
-                if member.name == name:
-                    channel = await member.create_dm()
-                    if type(message) == str:
-                        await channel.send(message)
-                    elif type(message) == discord.File:
-                        await channel.send(file=message)
-                    break
-        if register_editable:
-            self.edit_target_message = \
-                [message async for message in channel.history(limit=1)][0]
+            channel = self.get_channel(session.gc.gamech_id)
+            return await channel.send(message)
+        member = self.members.get_by_name(name)
+        if member is None:
+            return None
+        channel = await self.get_dm_channel(member)
+        try:
+            if type(message) == str:
+                return await channel.send(message)
+            elif type(message) == discord.File:
+                return await channel.send(file=message)
+        except discord.HTTPException:
+            self.dm_cache.invalidate(member.id)
+            raise
+        return None
     
+    async def get_dm_channel(self, member: discord.Member) -> discord.abc.Messageable:
+        channel = self.dm_cache.get(member.id)
+        if channel is None:
+            channel = await member.create_dm()
+            self.dm_cache.put(member.id, channel)
+        return channel
+
+    async def close(self) -> None:
+        self.print_command_counts()
+        self.dm_cache.save()
+        if self.journal is not None:
+            if self.sessions is not None:
+                await self.sessions.snapshot()
+            await asyncio.get_running_loop().run_in_executor(None, self.journal.close)
+        await super().close()
+
     def load_channel(self, id: int) -> None:
         self.gamech_id = id
     
+    def set_content_cache(self, path: Union[str, None]) -> None:
+        CONTENT_STORE.set_cache_dir(path)
+
+    def set_content_watch_interval(self, interval: float) -> None:
+        self.content_watch_interval = interval
+
     def set_ntn_lo(self, path: Union[str, None]) -> None:
         self.ntn_lo_path = path
+        get_layout_list(path)
 
     def set_bfs_th(self, path: Union[str, None]) -> None:
         self.bfs_th_path = path
+        get_theme_list(path)
+
+    def set_aap_lt(self, path: Union[str, None]) -> None:
+        self.aap_letter_table = load_letter_table(path)
+
+    def set_tab_archive(self, path: Union[str, None]) -> None:
+        self.tab_archive = None if path is None else BookArchive(path)
+
+    def set_dm_cache(self, path: Union[str, None], max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.dm_cache = DMChannelCache(max_size, path)
+        self.dm_cache.load(self.get_partial_messageable)
+
+    def set_journal(self, path: Union[str, None], snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL) -> None:
+        self.journal = None if path is None else Journal(path)
+        self.snapshot_interval = snapshot_interval
+
+    def set_turn_deadline(self, deadline: float, nudge: float = 0.0, auto_advance: bool = False) -> None:
+        """
+        deadline: 提出を待つ各段階の締め切りまでの秒数（0 で締め切りを設けない）
+        """
+        self.turn_timers = TurnTimers(deadline, nudge, time.time()) if deadline > 0 else None
+        self.auto_advance = auto_advance
+
+    def set_eviction(self, idle: float, ttl: float, memory_budget: int) -> None:
+        """
+        idle: 使われていないセッションを圧縮して退避するまでの秒数（0 で退避しない）
+        ttl: 退避したセッションを破棄するまでの秒数（0 で破棄しない）
+        memory_budget: セッション全体の大きさの上限のバイト数（0 で上限を設けない）
+        """
+        self.session_idle = idle
+        self.session_ttl = ttl
+        self.memory_budget = memory_budget
+
+    def set_max_content_length(self, length: int) -> None:
+        self.message_filter.max_content_length = length
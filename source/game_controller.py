@@ -1,10 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import List, Tuple, Union
+from types import MappingProxyType
+from typing import Any, Dict, Hashable, List, Mapping, Tuple, Union
 
 import discord
 
 from source.command import Command
+from source.member_directory import MemberDirectory
+from source.router import CommandRouter
 
 ICONS_B = {
     "MAIN": ":book:",
@@ -13,20 +16,45 @@ ICONS_B = {
 COMMANDS_B = {
     "HLP": Command("!help", "今見ているこの画面を表示します。"),
     "HLPG": Command("!help_game", "各ゲームの概要を説明します。"),
-    "LNCG": Command("!launch_game", "ゲームを起動します。現在起動中のゲームの情報は破棄されます。"),
+    "LNCG": Command("!launch_game", "このチャンネルでゲームを起動します。このチャンネルで起動中のゲームの情報は破棄されます。"),
     "SETCH": Command("!set_channel", "全体公開メッセージを投稿するチャンネルIDを設定します。"),
-    "RELOADMMB": Command("!reload_member", "当botから見えるアカウント一覧を再読み込みします。"),
+    "RELOADMMB": Command("!reload_member", "当botから見えるアカウント一覧を再読み込みします（通常は自動で更新されます）。"),
 }
 ALWAYS_ALLOWED_COMMANDS_B = [
     "HLP",
     "HLPG",
 ]
+HANDLERS_B = {
+    "HLP": "help",
+    "HLPG": "help_game",
+    "LNCG": "launch_game",
+    "SETCH": "set_channel",
+    "RELOADMMB": "reload_member",
+}
+PHASES_B = {
+    "S": "standby",
+}
+ALLOWED_COMMANDS_PER_PHASE_B = {
+    PHASES_B["S"]: [
+        "LNCG",
+        "SETCH",
+        "RELOADMMB",
+    ],
+}
+# ゲームの状態を変えないため、ジャーナルに記録しない処理
+UNJOURNALED_HANDLERS = frozenset([
+    "help",
+    "help_game",
+    "show_players",
+    "reload_member",
+])
 
 class OnMessageResponse:
     message_list: List[Tuple[Union[str, None], Union[str, discord.File]]]
     switch_game: Union[int, None]
     register_editable_i: Union[int, None]
     edit: bool
+    editable_slot: int
     
     def __init__(
             self,
@@ -34,46 +62,103 @@ class OnMessageResponse:
             switch_game: Union[int, None] = None,
             register_editable: Union[int, None] = None,
             edit: bool = False,
+            editable_slot: int = 0,
         ) -> None:
+        """
+        register_editable: message_list のうち、後から編集するために記録するメッセージの番号
+        edit: message_list の先頭の内容で記録済みのメッセージを編集する
+        editable_slot: 記録・編集の対象となる枠の番号（1ゲームで複数のメッセージを扱う場合に使う）
+        """
         self.message_list = message_list
         self.switch_game = switch_game
         self.register_editable_i = register_editable
         self.edit = edit
+        self.editable_slot = editable_slot
 
 class GameController:
-    commands_dictionary: dict # of str: Command
-    function_dictionary: dict # of str: function
+    commands_dictionary: Mapping[str, Command] = MappingProxyType(COMMANDS_B)
+    router: CommandRouter = CommandRouter(
+        commands_dictionary, HANDLERS_B,
+        ALLOWED_COMMANDS_PER_PHASE_B, ALWAYS_ALLOWED_COMMANDS_B,
+    )
     gamech_id: int
-    members: list
+    phase: str
+    members: MemberDirectory
 
     # function to be called on initialization
-    def initialize(self, get_all_members, gamech_id: int):
-        self.get_all_members = get_all_members
+    def initialize(self, members: MemberDirectory, gamech_id: int):
         self.gamech_id = gamech_id
-        self.members = [member for member in self.get_all_members()]
+        self.members = members
 
-        self.commands_dictionary = COMMANDS_B
-        self.function_dictionary = {
-            self.commands_dictionary["HLP"].get_command(): self.help,
-            self.commands_dictionary["HLPG"].get_command(): self.help_game,
-            self.commands_dictionary["SETCH"].get_command(): self.set_channel,
-            self.commands_dictionary["RELOADMMB"].get_command(): self.reload_member,
-        }
+        self.phase = PHASES_B["S"]
 
         print("initialization ok")
 
+    def __getstate__(self) -> dict:
+        # メンバー一覧は全セッションで共有しているため、復元時に付け直す
+        state = self.__dict__.copy()
+        state.pop("members", None)
+        return state
+
+    def is_journaled(self, content: str) -> bool:
+        """
+        content が現在のフェーズで受け付けられ、ゲームの状態を変えうるコマンドかどうか。
+        """
+        handler_name = self.router.lookup(content.partition(" ")[0], self.phase)
+        return handler_name is not None and handler_name not in UNJOURNALED_HANDLERS
+
+    def use_carryover(self, carryover: Dict[str, Any]) -> None:
+        """
+        同じチャンネルでゲームを切り替えても引き継ぐ状態を受け取る。
+        引き継ぐものがあれば carryover から取り出し、なければ自分の状態を登録する。
+        """
+        pass
+
+    def get_turn_key(self) -> Union[Hashable, None]:
+        """
+        プレイヤーの提出かゲームマスターの進行を待っている段階を表す値。
+        値が変わるたびに締め切りを設定し直す。
+        締め切りを設けない段階では None を返す。
+        """
+        return None
+
+    def pending_players(self) -> List[str]:
+        """
+        現在の段階でまだ提出していないプレイヤーの名前のリスト。
+        """
+        return []
+
+    def on_deadline(self) -> OnMessageResponse:
+        """
+        締め切りを過ぎたとき、未提出の分を既定の内容で埋めて次の段階に進める。
+        """
+        return OnMessageResponse([])
+
+    def on_nudge(self, remaining: float) -> OnMessageResponse:
+        ret_mes = f"{ICONS_B['CAUT']} 締め切りまであと{max(1, round(remaining / 60))}分です。まだ提出が済んでいません！"
+        return OnMessageResponse([(name, ret_mes) for name in self.pending_players()])
+
+    def on_overdue(self) -> OnMessageResponse:
+        pending = self.pending_players()
+        if len(pending) == 0:
+            return OnMessageResponse([])
+        ret_mes = f"{ICONS_B['CAUT']} 締め切りを過ぎました。未提出：" + "、".join(pending)
+        return OnMessageResponse([(None, ret_mes)])
+
     # function to be called on receiving message.
     def on_message(self, message: discord.Message) -> OnMessageResponse:
-        sep = message.content.split(" ")
-        author = message.author
-
-        if sep[0] == self.commands_dictionary["LNCG"].get_command():
-            return self.launch_game(" ".join(sep[1:]), author)
-        elif sep[0] in self.function_dictionary.keys():
-            return self.function_dictionary[sep[0]]\
-                        (" ".join(sep[1:]), author)
-        
-        return OnMessageResponse([])
+        command, _, args_str = message.content.partition(" ")
+        handler_name = self.router.route(command, self.phase)
+        if handler_name is None:
+            if self.router.is_known(command):
+                ret_mes = f"{ICONS_B['CAUT']} 現在のフェーズ「{self.phase}」では使用できないコマンドです。"
+                return OnMessageResponse([(message.author.name, ret_mes)])
+            return OnMessageResponse([])
+
+        ret = getattr(self, handler_name)(args_str, message.author)
+        if ret is None:
+            return OnMessageResponse([])
+        return ret
 
     def help(self, _, author: discord.Member) -> OnMessageResponse:
         help_str = "\n".join([
@@ -173,5 +258,5 @@ class GameController:
     
     def reload_member(self, _, author: discord.Member) -> OnMessageResponse:
         ret_mes = f"{ICONS_B['MAIN']} 参加しているサーバからアカウント一覧を読み込み直しました。"
-        self.members = [member for member in self.get_all_members()]
+        self.members.reload()
         return OnMessageResponse([(author.name, ret_mes)])
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import pickle
+import queue
+import threading
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+DEFAULT_SNAPSHOT_INTERVAL = 60.0
+SNAPSHOT_FILE = "snapshot.pickle"
+SEGMENT_PREFIX = "journal_"
+SEGMENT_SUFFIX = ".jsonl"
+
+class Snapshot:
+    """
+    seq より後の記録を再生すれば最新の状態に戻る。セッションは1つずつ直列化するため、
+    seq より後の記録を含んでいることがあり、その分は session_seqs で読み飛ばす。
+    """
+    seq: int
+    sessions: Dict[int, bytes] # of session key: pickled Session
+    dm_routes: Dict[int, int] # of user id: session key
+    session_seqs: Dict[int, int] # of session key: last seq included in the pickled Session
+
+    def __init__(
+            self,
+            seq: int,
+            sessions: Dict[int, bytes],
+            dm_routes: Dict[int, int],
+            session_seqs: Union[Dict[int, int], None] = None,
+        ) -> None:
+        self.seq = seq
+        self.sessions = sessions
+        self.dm_routes = dm_routes
+        self.session_seqs = {} if session_seqs is None else session_seqs
+
+    def __setstate__(self, state: dict) -> None:
+        # session_seqs を持たない以前のスナップショットも読めるようにする
+        self.__init__(state["seq"], state["sessions"], state["dm_routes"], state.get("session_seqs"))
+
+class ReplayAuthor:
+    """
+    ジャーナルから再生するコマンドの送信者。コントローラが参照する属性だけを持つ。
+    """
+    __slots__ = ("id", "name")
+
+    def __init__(self, id: int, name: str) -> None:
+        self.id = id
+        self.name = name
+
+class ReplayMessage:
+    __slots__ = ("content", "author")
+
+    def __init__(self, content: str, author: ReplayAuthor) -> None:
+        self.content = content
+        self.author = author
+
+class Journal:
+    """
+    状態を変えたコマンドを1行1件のJSONとして追記するジャーナル。
+    書き込みは別スレッドで行い、その時点で溜まっている分をまとめて fsync する。
+    スナップショットを書き終えたら新しいファイルに切り替え、それ以前のファイルは削除する。
+    """
+    _dir: str
+    _seq: int
+    _queue: "queue.Queue[Union[Tuple[str, Any], None]]"
+    _thread: Union[threading.Thread, None]
+
+    def __init__(self, dir: str) -> None:
+        self._dir = dir
+        os.makedirs(dir, exist_ok=True)
+        snapshot = self.load_snapshot()
+        self._seq = 0 if snapshot is None else snapshot.seq
+        for entry in self.read_entries(self._seq):
+            self._seq = entry["seq"]
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def get_seq(self) -> int:
+        return self._seq
+
+    def append(self, entry: Dict[str, Any]) -> int:
+        """
+        entry に通し番号を付けて書き込みを予約し、その番号を返す。
+        """
+        self._seq += 1
+        entry["seq"] = self._seq
+        self._queue.put(("entry", json.dumps(entry, ensure_ascii=False)))
+        return self._seq
+
+    def write_snapshot(self, snapshot: Snapshot) -> None:
+        # 直列化している間に追記された記録は、ここまでのファイルに残す
+        self._queue.put(("snapshot", (snapshot, self._seq)))
+
+    def load_snapshot(self) -> Union[Snapshot, None]:
+        path = os.path.join(self._dir, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def read_entries(self, after_seq: int) -> Iterator[Dict[str, Any]]:
+        """
+        通し番号が after_seq より大きい記録を順に返す。
+        クラッシュで途中までしか書かれなかった行は読み飛ばす。
+        """
+        for _, path in self._segments():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry["seq"] > after_seq:
+                        yield entry
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        segments = []
+        for filename in os.listdir(self._dir):
+            if filename.startswith(SEGMENT_PREFIX) and filename.endswith(SEGMENT_SUFFIX):
+                first_seq = int(filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                segments.append((first_seq, os.path.join(self._dir, filename)))
+        segments.sort()
+        return segments
+
+    def _open_segment(self, first_seq: int):
+        path = os.path.join(self._dir, f"{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}")
+        f = open(path, "a", encoding="utf-8")
+        if f.tell() > 0:
+            # 途中までしか書かれなかった行に続けて書かないよう改行を入れる
+            f.write("\n")
+        return f
+
+    def _run(self) -> None:
+        f = self._open_segment(self._seq + 1)
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    stop = True
+                    continue
+                kind, payload = item
+                try:
+                    if kind == "entry":
+                        f.write(payload + "\n")
+                    else:
+                        snapshot, last_seq = payload
+                        f.flush()
+                        os.fsync(f.fileno())
+                        self._save_snapshot(snapshot)
+                        f.close()
+                        f = self._open_segment(last_seq + 1)
+                        self._remove_segments_upto(snapshot.seq)
+                except OSError as e:
+                    print(f"failed to write journal: {e!r}")
+            try:
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError as e:
+                print(f"failed to sync journal: {e!r}")
+        f.close()
+
+    def _save_snapshot(self, snapshot: Snapshot) -> None:
+        path = os.path.join(self._dir, SNAPSHOT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _remove_segments_upto(self, seq: int) -> None:
+        """
+        記録がすべて seq 以前であるファイルを削除する。
+        各ファイルには次のファイルの先頭の番号の手前までの記録が入っている。
+        """
+        segments = self._segments()
+        for (_, path), (next_first_seq, _) in zip(segments, segments[1:]):
+            if next_first_seq - 1 <= seq:
+                os.remove(path)
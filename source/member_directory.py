@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Callable, Dict, Iterable, Iterator, Sequence, Set, Union
+
+import discord
+
+class MemberDirectory:
+    """
+    botから見えるアカウントをIDと名前で引けるようにした一覧。
+    全セッションで共有し、メンバーの参加・更新・脱退イベントで差分更新する。
+    同じユーザが複数のサーバに所属している場合はサーバごとのMemberを保持する。
+    """
+    _by_id: Dict[int, Dict[int, discord.Member]] # of user id: {guild id: Member}
+    _by_name: Dict[str, int] # of name: user id
+    _by_guild: Dict[int, Set[int]] # of guild id: user ids
+    _get_all_members: Callable
+
+    def __init__(self, get_all_members: Callable) -> None:
+        self._by_id = {}
+        self._by_name = {}
+        self._by_guild = {}
+        self._get_all_members = get_all_members
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __iter__(self) -> Iterator[discord.Member]:
+        for members in self._by_id.values():
+            yield next(iter(members.values()))
+
+    def reload(self) -> None:
+        self._by_id = {}
+        self._by_name = {}
+        self._by_guild = {}
+        for member in self._get_all_members():
+            self.add(member)
+
+    def reload_guild(self, guild_id: int, members: Iterable[discord.Member]) -> None:
+        """
+        1つのサーバの分だけを読み直す。
+        """
+        self.remove_guild(guild_id)
+        self._by_guild[guild_id] = set()
+        for member in members:
+            self.add(member)
+
+    def remove_guild(self, guild_id: int) -> None:
+        for user_id in self._by_guild.pop(guild_id, set()):
+            self._discard(user_id, guild_id)
+
+    def matches_guild(self, guild_id: int, members: Sequence[discord.Member]) -> bool:
+        """
+        読み込み済みのサーバのメンバーが members と同じIDと名前の組であるかどうか。
+        数が食い違えばすぐに False を返す。
+        """
+        user_ids = self._by_guild.get(guild_id)
+        if user_ids is None or len(user_ids) != len(members):
+            return False
+        for member in members:
+            stored = self._by_id.get(member.id, {}).get(guild_id)
+            if stored is None or stored.name != member.name:
+                return False
+        return True
+
+    def get_guild_ids(self) -> Set[int]:
+        return set(self._by_guild.keys())
+
+    def add(self, member: discord.Member) -> None:
+        self._by_id.setdefault(member.id, {})[member.guild.id] = member
+        self._by_name[member.name] = member.id
+        self._by_guild.setdefault(member.guild.id, set()).add(member.id)
+
+    def update(self, before: discord.Member, after: discord.Member) -> None:
+        if before.name != after.name and self._by_name.get(before.name) == before.id:
+            del self._by_name[before.name]
+        self.add(after)
+
+    def update_user(self, before: discord.User, after: discord.User) -> None:
+        if before.name == after.name:
+            return
+        if self._by_name.get(before.name) == before.id:
+            del self._by_name[before.name]
+        if after.id in self._by_id:
+            self._by_name[after.name] = after.id
+
+    def remove(self, member: discord.Member) -> None:
+        user_ids = self._by_guild.get(member.guild.id)
+        if user_ids is not None:
+            user_ids.discard(member.id)
+        self._discard(member.id, member.guild.id)
+
+    def _discard(self, user_id: int, guild_id: int) -> None:
+        members = self._by_id.get(user_id)
+        if members is None:
+            return
+        member = members.pop(guild_id, None)
+        if len(members) == 0:
+            del self._by_id[user_id]
+            if member is not None and self._by_name.get(member.name) == user_id:
+                del self._by_name[member.name]
+
+    def get(self, user_id: int) -> Union[discord.Member, None]:
+        members = self._by_id.get(user_id)
+        if members is None:
+            return None
+        return next(iter(members.values()))
+
+    def get_by_name(self, name: str) -> Union[discord.Member, None]:
+        user_id = self._by_name.get(name)
+        if user_id is None:
+            return None
+        return self.get(user_id)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Callable, Dict
+
+import discord
+
+from source.game_controller import COMMANDS_B
+
+COMMAND_PREFIX = "!"
+DEFAULT_MAX_CONTENT_LENGTH = 4000
+
+class MessageFilter:
+    """
+    コマンドとして処理する必要のないメッセージを、分割や応答の生成より前に捨てる。
+    捨てた理由ごとに件数を数える。
+    """
+    max_content_length: int
+    accepted: int
+    dropped: Dict[str, int] # of reason: count
+    _launch_command: str
+
+    def __init__(self, max_content_length: int = DEFAULT_MAX_CONTENT_LENGTH) -> None:
+        self.max_content_length = max_content_length
+        self.accepted = 0
+        self.dropped = {
+            "self": 0,
+            "bot": 0,
+            "prefix": 0,
+            "size": 0,
+            "channel": 0,
+        }
+        self._launch_command = COMMANDS_B["LNCG"].get_command()
+
+    def accept(
+            self,
+            message: discord.Message,
+            self_id: int,
+            has_session: Callable[[int], bool],
+        ) -> bool:
+        """
+        self_id: bot自身のユーザID
+        has_session: チャンネルIDを受け取り、そのチャンネルでセッションが進行中かを返す関数
+        """
+        author = message.author
+        if author.id == self_id:
+            self.dropped["self"] += 1
+            return False
+        if author.bot:
+            self.dropped["bot"] += 1
+            return False
+        content = message.content
+        if not content.startswith(COMMAND_PREFIX):
+            self.dropped["prefix"] += 1
+            return False
+        if len(content) > self.max_content_length:
+            self.dropped["size"] += 1
+            return False
+        if message.guild is not None \
+                and not has_session(message.channel.id) \
+                and not content.startswith(self._launch_command):
+            self.dropped["channel"] += 1
+            return False
+        self.accepted += 1
+        return True
@@ -1,14 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import Callable, Dict, List, Tuple, Union
+from types import MappingProxyType
+from typing import Hashable, List, Mapping, Tuple, Union
 
 import discord
 
 from source.command import Command
-from source.game_controller import GameController, OnMessageResponse, COMMANDS_B, ALWAYS_ALLOWED_COMMANDS_B
+from source.game_controller import GameController, OnMessageResponse, COMMANDS_B, ALWAYS_ALLOWED_COMMANDS_B, HANDLERS_B
+from source.member_directory import MemberDirectory
+from source.router import CommandRouter
 from source.ntn.player import PlayerMaster
 from source.ntn.script import Script
 
+DEFAULT_WORD = "（空欄）"
 ICONS_N = {
     "MAIN": ":newspaper:",
     "CAUT": ":exclamation:",
@@ -53,14 +57,28 @@ ALWAYS_ALLOWED_COMMANDS_N = [
     "SHOWPL",
 ]
 ALWAYS_ALLOWED_COMMANDS_N += ALWAYS_ALLOWED_COMMANDS_B
+HANDLERS_N = {
+    **HANDLERS_B,
+    "SHOWPL": "show_players",
+    "JOIN": "join",
+    "LEAVE": "leave",
+    "RESETMMB": "reset_players",
+    "START": "start_game",
+    "QUITGM": "quit_game",
+    "FILL": "fill",
+    "ENDFL": "end_fill",
+    "OPEN": "open",
+}
 
 class NTNController(GameController):
-    allowed_commands_per_phase: Dict[str, str]
-    commands_dictionary: Dict[str, Command]
-    function_dictionary: Dict[str, Callable]
+    commands_dictionary: Mapping[str, Command] = MappingProxyType({**COMMANDS_N, **COMMANDS_B})
+    router: CommandRouter = CommandRouter(
+        commands_dictionary, HANDLERS_N,
+        ALLOWED_COMMANDS_PER_PHASE_N, ALWAYS_ALLOWED_COMMANDS_N,
+    )
     gamech_id: int
     phase: str
-    members: List[discord.Member]
+    members: MemberDirectory
     script: Script
     playermaster: PlayerMaster
     next_open_id: int
@@ -71,35 +89,11 @@ class NTNController(GameController):
         super().__init__()
         self.script = Script(lo_path)
 
-    def initialize(self, get_all_members: Callable, gamech_id: int):
-        self.get_all_members = get_all_members
+    def initialize(self, members: MemberDirectory, gamech_id: int):
         self.gamech_id = gamech_id
-        self.members = [member for member in self.get_all_members()]
+        self.members = members
         self.playermaster = PlayerMaster()
 
-        self.commands_dictionary = COMMANDS_N
-        self.commands_dictionary.update(COMMANDS_B)
-
-        self.allowed_commands_per_phase = {}
-        for p in PHASES.values():
-            self.allowed_commands_per_phase[p] = []
-            for c in ALLOWED_COMMANDS_PER_PHASE_N[p] + ALWAYS_ALLOWED_COMMANDS_N:
-                self.allowed_commands_per_phase[p]\
-                                .append(self.commands_dictionary[c].get_command())
-
-        self.function_dictionary = {
-            self.commands_dictionary["HLP"].get_command(): self.help,
-            self.commands_dictionary["SHOWPL"].get_command(): self.show_players,
-            self.commands_dictionary["JOIN"].get_command(): self.join,
-            self.commands_dictionary["LEAVE"].get_command(): self.leave,
-            self.commands_dictionary["RESETMMB"].get_command(): self.reset_players,
-            self.commands_dictionary["START"].get_command(): self.start_game,
-            self.commands_dictionary["QUITGM"].get_command(): self.quit_game,
-            self.commands_dictionary["FILL"].get_command(): self.fill,
-            self.commands_dictionary["ENDFL"].get_command(): self.end_fill,
-            self.commands_dictionary["OPEN"].get_command(): self.open,
-        }
-
         self.phase = PHASES["S"]
 
         print("initialization ok")
@@ -253,7 +247,8 @@ class NTNController(GameController):
         for valid_id in valid_ids:
             if self.script.is_filled(valid_id):
                 open_ids.append(valid_id)
-        ret_mes = f"{ICONS_N['MAIN']} 入力を受け付けました！\n" \
+        ret_mes = f"{ICONS_N['MAIN']} 入力を受け付けました！" \
+                + f"（{self.script.count_filled()}/{self.script.num_blank}個の空欄が記入済み）\n" \
                 + "現在の原稿はこちらです。\n" \
                 + "```\n" \
                 + f"{self.script.show_script_limit_open(open_ids)}\n" \
@@ -299,3 +294,33 @@ class NTNController(GameController):
                 + f"{self.script.show_script_limit_open(open_ids)}\n" \
                 + "```"
         return OnMessageResponse([(None, ret_mes)], edit=True)
+
+    def get_turn_key(self) -> Union[Hashable, None]:
+        if self.phase == PHASES["F"]:
+            return (self.phase,)
+        if self.phase == PHASES["R"]:
+            return (self.phase, self.next_open_id)
+        return None
+
+    def pending_players(self) -> List[str]:
+        if self.phase != PHASES["F"]:
+            return []
+        return [
+            p.get_name() for p in self.playermaster.get_players()
+            if not all(self.script.is_filled(i) for i in p.get_valid_ids())
+        ]
+
+    def on_deadline(self) -> OnMessageResponse:
+        if self.phase == PHASES["R"]:
+            # 台本を編集するだけの応答なので、通知は付けずに次の空欄を開く
+            return self.open(None, None)
+        if self.phase != PHASES["F"]:
+            return OnMessageResponse([])
+        for i in range(self.script.num_blank):
+            if not self.script.is_filled(i):
+                self.script.fill_blank(i, DEFAULT_WORD)
+        ret_mes = f"{ICONS_N['CAUT']} 締め切りを過ぎたため、未記入の空欄を「{DEFAULT_WORD}」として進めます。"
+        res = self.end_fill(None, None)
+        res.message_list.insert(0, (None, ret_mes))
+        res.register_editable_i += 1
+        return res
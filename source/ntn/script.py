@@ -3,7 +3,10 @@
 import json
 import os
 import random
-from typing import Dict, List, Union
+import re
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Tuple, Union
+
+from source.content_store import CONTENT_STORE
 
 
 DEFAULT_SCRIPT_LAYOUT = os.path.join(os.path.dirname(__file__), "layout.json")
@@ -11,84 +14,159 @@ DEFAULT_SCRIPT_LAYOUT = os.path.join(os.path.dirname(__file__), "layout.json")
 class InvalidLayoutError(Exception):
     pass
 
+class Layout(NamedTuple):
+    num_blank: int
+    blank_pattern: str
+    layout: str
+    segments: Tuple[Union[str, int], ...] # of literal text or blank id
+
 class Script:
     num_blank: Union[int, None]
-    num_layout: int
+    _lo_path: Union[str, None]
     _blank_pattern: Union[str, None]
-    _lo_list: List[dict]
     _layout: Union[str, None]
     _id_word_map: Union[Dict[int, Union[str, None]], None]
+    _num_filled: int
+    _segments: Tuple[Union[str, int], ...] # of literal text or blank id
+    _blank_parts: List[str]
+    _open_parts: List[Union[str, None]]
+    _render_cache: Dict[FrozenSet[int], str] # of open blank ids: rendered script
 
     def __init__(self, lo_path: Union[str, None]) -> None:
-        self._load_layout_dict(lo_path)
+        self._lo_path = lo_path
+        get_layout_list(lo_path)
         self.num_blank = None
         self._blank_pattern = None
         self._layout = None
         self._id_word_map = None
-    
-    def _load_layout_dict(self, lo_path: Union[str, None]) -> None:
-        if lo_path is None:
-            lo_path = DEFAULT_SCRIPT_LAYOUT
-        
-        with open(lo_path, "r") as f:
-            self._lo_list: List[dict] = json.loads(f.read())["layout_list"]
-        self.num_layout = len(self._lo_list)
+        self._num_filled = 0
+        self._segments = ()
+        self._blank_parts = []
+        self._open_parts = []
+        self._render_cache = {}
+
+    @property
+    def num_layout(self) -> int:
+        return len(get_layout_list(self._lo_path))
     
     def set_layout(self, i: Union[int, None]) -> None:
+        lo_list = get_layout_list(self._lo_path)
         if i is None:
-            i = random.randint(0, len(self._lo_list) - 1)
-        lo = self._lo_list[i]
+            i = random.randint(0, len(lo_list) - 1)
+        lo = lo_list[i]
 
-        self.num_blank = lo["num_blank"]
-        self._blank_pattern = lo["blank_pattern"]
-        self._layout = lo["layout"]
+        self.num_blank = lo.num_blank
+        self._blank_pattern = lo.blank_pattern
+        self._layout = lo.layout
 
         self._id_word_map = {}
         for i in range(self.num_blank):
             self._id_word_map[i] = None
+        self._num_filled = 0
+
+        self._segments = lo.segments
+        self._blank_parts = [f"[ {i + 1} ]" for i in range(self.num_blank)]
+        self._open_parts = [None] * self.num_blank
+        self._render_cache = {}
+
+    def _render(self, open_ids: Iterable[int]) -> str:
+        """
+        open_ids のうち記入済みの空欄だけを開けた原稿を返す。同じ開き方の原稿は使い回す。
+        """
+        key = frozenset(i for i in open_ids if self._open_parts[i] is not None)
+        rendered = self._render_cache.get(key)
+        if rendered is None:
+            rendered = "".join(
+                seg if type(seg) is str
+                else self._open_parts[seg] if seg in key
+                else self._blank_parts[seg]
+                for seg in self._segments
+            )
+            self._render_cache[key] = rendered
+        return rendered
     
     def show_script(self) -> str:
-        disp_script: str = self._layout
-        for i in range(self.num_blank):
-            if self._id_word_map[i] is not None:
-                disp_script = disp_script.replace(
-                    self._blank_pattern.replace("N", str(i + 1)),
-                    f"[ {self._id_word_map[i]} ]",
-                )
-        return disp_script
+        return "".join(
+            seg if type(seg) is str
+            else self._blank_pattern.replace("N", str(seg + 1)) if self._open_parts[seg] is None
+            else self._open_parts[seg]
+            for seg in self._segments
+        )
     
     def show_script_blank(self) -> str:
-        disp_script: str = self._layout
-        for i in range(self.num_blank):
-            disp_script = disp_script.replace(
-                self._blank_pattern.replace("N", str(i + 1)),
-                f"[ {i + 1} ]",
-            )
-        return disp_script
+        return self._render(())
     
     def show_script_limit_open(self, open_ids: List[int]) -> str:
-        disp_script: str = self._layout
-        for i in open_ids:
-            if self._id_word_map[i] is not None:
-                disp_script = disp_script.replace(
-                    self._blank_pattern.replace("N", str(i + 1)),
-                    f"[ {self._id_word_map[i]} ]",
-                )
-        for i in range(self.num_blank):
-            disp_script = disp_script.replace(
-                self._blank_pattern.replace("N", str(i + 1)),
-                f"[ {i + 1} ]",
-            )
-        return disp_script
+        return self._render(open_ids)
     
     def fill_blank(self, i: int, word: str) -> None:
         if i >= self.num_blank:
             raise ValueError()
 
+        if self._id_word_map[i] is None:
+            self._num_filled += 1
         self._id_word_map[i] = word
+        self._open_parts[i] = f"[ {word} ]"
+        for key in [key for key in self._render_cache if i in key]:
+            del self._render_cache[key]
     
     def is_filled(self, i: int) -> bool:
         return self._id_word_map[i] is not None
     
     def all_filled(self) -> bool:
-        return all(self._id_word_map[i] is not None for i in range(self.num_blank))
+        return self._num_filled == self.num_blank
+
+    def count_filled(self) -> int:
+        return self._num_filled
+
+def compile_layout(layout: str, blank_pattern: str, num_blank: int) -> List[Union[str, int]]:
+    """
+    原稿を地の文と空欄の並びに分解する。空欄は0始まりの番号で表す。
+    blank_pattern の "N" の位置に 1 から num_blank までの番号が入ったものを空欄とみなす。
+    """
+    prefix, _, suffix = blank_pattern.partition("N")
+    regex = re.compile(re.escape(prefix) + r"(\d+)" + re.escape(suffix))
+    segments: List[Union[str, int]] = []
+    last = 0
+    for m in regex.finditer(layout):
+        number = m.group(1)
+        if str(int(number)) != number or not 1 <= int(number) <= num_blank:
+            continue
+        if m.start() > last:
+            segments.append(layout[last:m.start()])
+        segments.append(int(number) - 1)
+        last = m.end()
+    if last < len(layout):
+        segments.append(layout[last:])
+    return segments
+
+def get_layout_list(lo_path: Union[str, None]) -> Tuple[Layout, ...]:
+    if lo_path is None:
+        lo_path = DEFAULT_SCRIPT_LAYOUT
+    return CONTENT_STORE.get("ntn_layout", lo_path, parse_layout_list)
+
+def parse_layout_list(text: str) -> Tuple[Layout, ...]:
+    try:
+        lo_list = json.loads(text)["layout_list"]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidLayoutError()
+    if not isinstance(lo_list, list) or len(lo_list) == 0:
+        raise InvalidLayoutError()
+
+    ret = []
+    for lo in lo_list:
+        try:
+            num_blank = lo["num_blank"]
+            blank_pattern = lo["blank_pattern"]
+            layout = lo["layout"]
+        except (KeyError, TypeError):
+            raise InvalidLayoutError()
+        if not isinstance(num_blank, int) or num_blank <= 0 \
+                or not isinstance(blank_pattern, str) or "N" not in blank_pattern \
+                or not isinstance(layout, str):
+            raise InvalidLayoutError()
+        ret.append(Layout(
+            num_blank, blank_pattern, layout,
+            tuple(compile_layout(layout, blank_pattern, num_blank)),
+        ))
+    return tuple(ret)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections import Counter
+from typing import Dict, FrozenSet, List, Union
+
+from source.command import Command
+
+class CommandRouter:
+    """
+    コマンド文字列から処理関数名を引くための表。コントローラのクラスごとに一度だけ作る。
+    フェーズごとに許可されたコマンドの集合を持ち、許可されていないコマンドは処理関数に渡さない。
+    """
+    _handlers: Dict[str, str] # of command string: method name
+    _allowed: Dict[str, FrozenSet[str]] # of phase: command strings
+    dispatch_counts: Counter
+    reject_counts: Counter
+
+    def __init__(
+            self,
+            commands: Dict[str, Command],
+            handlers: Dict[str, str],
+            allowed_commands_per_phase: Dict[str, List[str]],
+            always_allowed_commands: List[str],
+        ) -> None:
+        """
+        commands: コマンドのキーとCommandの対応
+        handlers: コマンドのキーと処理関数名の対応
+        allowed_commands_per_phase: フェーズ名と、そのフェーズで許可するコマンドのキーのリストの対応
+        always_allowed_commands: すべてのフェーズで許可するコマンドのキーのリスト
+        """
+        self._handlers = {
+            commands[key].get_command(): name for key, name in handlers.items()
+        }
+        self._allowed = {}
+        for phase, keys in allowed_commands_per_phase.items():
+            allowed = frozenset(
+                commands[key].get_command() for key in keys + always_allowed_commands
+            )
+            missing = allowed.difference(self._handlers)
+            if missing:
+                raise KeyError(f"no handler for {sorted(missing)} in phase {phase}")
+            self._allowed[phase] = allowed
+        self.dispatch_counts = Counter()
+        self.reject_counts = Counter()
+
+    def lookup(self, command: str, phase: str) -> Union[str, None]:
+        """
+        route と同じだが、集計を行わない。
+        """
+        if command in self._allowed[phase]:
+            return self._handlers[command]
+        return None
+
+    def route(self, command: str, phase: str) -> Union[str, None]:
+        """
+        現在のフェーズで command が許可されていればその処理関数名を返す。
+        """
+        if command in self._allowed[phase]:
+            self.dispatch_counts[command] += 1
+            return self._handlers[command]
+        if command in self._handlers:
+            self.reject_counts["phase"] += 1
+        else:
+            self.reject_counts["unknown"] += 1
+        return None
+
+    def is_known(self, command: str) -> bool:
+        return command in self._handlers
+
+    def format_counts(self) -> str:
+        """
+        コマンドごとの処理回数と、弾いたコマンドの数を1行にまとめる。
+        """
+        dispatched = ", ".join(f"{command}={n}" for command, n in self.dispatch_counts.most_common())
+        rejected = ", ".join(f"{reason}={n}" for reason, n in sorted(self.reject_counts.items()))
+        return f"dispatched [{dispatched}] rejected [{rejected}]"
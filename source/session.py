@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import pickle
+import random
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Set, Tuple, Union
+
+import discord
+
+from source.game_controller import GameController, OnMessageResponse
+from source.journal import Journal, ReplayAuthor, ReplayMessage, Snapshot
+from source.member_directory import MemberDirectory
+from source.timer_wheel import Timer
+
+class Session:
+    """
+    1つのチャンネルのゲーム。lock を持っている間だけコントローラに触れ、
+    同じセッション宛てのコマンドは届いた順に1つずつ処理する。
+    """
+    key: int
+    gc: GameController
+    carryover: Dict[str, Any] # of name: state kept across games in this channel
+    editable_messages: Dict[int, discord.Message] # of slot: Message
+    turn_key: Union[Hashable, None]
+    deadline: Union[float, None] # of UNIX time
+    timers: List[Timer]
+    last_active: float # of UNIX time
+    lock: asyncio.Lock
+
+    def __init__(self, key: int, gc: GameController) -> None:
+        self.key = key
+        self.gc = gc
+        self.carryover = {}
+        self.editable_messages = {}
+        self.turn_key = None
+        self.deadline = None
+        self.timers = []
+        self.last_active = time.time()
+        self.lock = asyncio.Lock()
+
+    def __getstate__(self) -> dict:
+        # 送信済みメッセージ、タイマー、ロックは復元できないため保存しない
+        return {
+            "key": self.key, "gc": self.gc, "carryover": self.carryover,
+            "turn_key": self.turn_key, "deadline": self.deadline,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["key"], state["gc"])
+        self.carryover = state.get("carryover", {})
+        self.turn_key = state.get("turn_key")
+        self.deadline = state.get("deadline")
+
+def serialize(session: Session) -> Tuple[bytes, bytes]:
+    """
+    セッションの直列化データと、それを圧縮したものを返す。
+    """
+    blob = pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL)
+    return blob, zlib.compress(blob)
+
+class SessionRegistry:
+    """
+    ギルドのチャンネルIDをキーとしてゲームのセッションを保持する。
+    DMはそのプレイヤーが最後にコマンドを送ったチャンネルのセッションに振り分ける。
+    journal が与えられた場合は状態を変えるコマンドを記録し、restore で再起動前の状態に戻す。
+    使われていないセッションは spill で圧縮した直列化データとして退避でき、
+    次にそのセッション宛てのメッセージが来たときに読み戻す。
+    """
+    _sessions: "OrderedDict[int, Session]" # in order of last use
+    _spilled: "OrderedDict[int, Tuple[bytes, float]]" # of session key: (compressed Session, spilled time)
+    _dm_routes: Dict[int, int] # of user id: session key
+    _default_key: int
+    _create_controller: Callable[[int], GameController]
+    _members: MemberDirectory
+    _journal: Union[Journal, None]
+    _dirty: Set[int] # of session key changed since the last snapshot
+    _sizes: Dict[int, int] # of session key: pickled size when last measured
+    _resized: Set[int] # of session key changed since the last measurement
+    _snapshot_blobs: Dict[int, bytes] # of session key: pickled Session
+    _seqs: Dict[int, int] # of session key: last journal seq applied
+    _snapshot_seqs: Dict[int, int] # of session key: last journal seq included in the pickled Session
+    on_load: Union[Callable[[Session], None], None]
+    on_unload: Union[Callable[[Session], None], None]
+
+    def __init__(
+            self,
+            default_key: int,
+            create_controller: Callable[[int], GameController],
+            members: MemberDirectory,
+            journal: Union[Journal, None] = None,
+        ) -> None:
+        self._sessions = OrderedDict()
+        self._spilled = OrderedDict()
+        self._dm_routes = {}
+        self._default_key = default_key
+        self._create_controller = create_controller
+        self._members = members
+        self._journal = journal
+        self._dirty = set()
+        self._sizes = {}
+        self._resized = set()
+        self._snapshot_blobs = {}
+        self._seqs = {}
+        self._snapshot_seqs = {}
+        self.on_load = None
+        self.on_unload = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self) -> Iterator[Session]:
+        """
+        メモリ上にあるセッションを、使われてから時間の経っている順に返す。
+        """
+        return iter(list(self._sessions.values()))
+
+    def has(self, key: int) -> bool:
+        return key in self._sessions or key in self._spilled
+
+    def get(self, key: int) -> Union[Session, None]:
+        if key in self._spilled:
+            return self._load(key)
+        return self._sessions.get(key)
+
+    def get_or_create(self, key: int) -> Session:
+        session = self.get(key)
+        if session is None:
+            gc = GameController()
+            gc.initialize(self._members, key)
+            session = Session(key, gc)
+            self._sessions[key] = session
+            self._touch(key)
+        return session
+
+    def route(self, message: discord.Message) -> Session:
+        if message.guild is None:
+            key = self._dm_routes.get(message.author.id, self._default_key)
+        else:
+            key = message.channel.id
+        session = self.get_or_create(key)
+        session.last_active = time.time()
+        self._sessions.move_to_end(key)
+        return session
+
+    def iter_spilled(self) -> Iterator[Tuple[int, int, float]]:
+        """
+        退避中のセッションのキー、圧縮後の大きさ、退避した時刻を退避した順に返す。
+        """
+        return iter([
+            (key, len(blob), spilled_at) for key, (blob, spilled_at) in self._spilled.items()
+        ])
+
+    async def spill(self, key: int) -> Union[int, None]:
+        """
+        セッションを圧縮した直列化データに置き換え、その大きさを返す。
+        直列化と圧縮はロックを持ったまま別スレッドで行い、その間にメッセージが来た場合は退避をやめて None を返す。
+        """
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+        async with session.lock:
+            if self._sessions.get(key) is not session:
+                return None
+            last_active = session.last_active
+            blob, compressed = await asyncio.get_running_loop().run_in_executor(None, serialize, session)
+            if session.last_active != last_active:
+                return None
+            del self._sessions[key]
+        if self.on_unload is not None:
+            self.on_unload(session)
+        # 読み戻したときの大きさとして使う
+        self._sizes[key] = len(blob)
+        self._resized.discard(key)
+        if self._journal is not None:
+            self._snapshot_blobs[key] = blob
+            self._snapshot_seqs[key] = self._seqs.get(key, 0)
+            self._dirty.discard(key)
+        self._spilled[key] = (compressed, time.time())
+        return len(compressed)
+
+    def drop(self, key: int) -> None:
+        """
+        セッションを破棄する。そのチャンネルに次にメッセージが来たときは新しいセッションになる。
+        再起動したときに破棄する前の記録から復元しないよう、ジャーナルにも記録する。
+        """
+        if self._journal is not None:
+            self._seqs[key] = self._journal.append({"key": key, "drop": True})
+        self._discard(key)
+
+    def _discard(self, key: int) -> None:
+        session = self._sessions.pop(key, None)
+        if session is not None and self.on_unload is not None:
+            self.on_unload(session)
+        self._spilled.pop(key, None)
+        self._sizes.pop(key, None)
+        self._resized.discard(key)
+        self._snapshot_seqs.pop(key, None)
+        if self._snapshot_blobs.pop(key, None) is not None:
+            # 次のスナップショットから取り除く
+            self._dirty.add(key)
+        self._dm_routes = {
+            user_id: k for user_id, k in self._dm_routes.items() if k != key
+        }
+
+    def _load(self, key: int) -> Session:
+        compressed, _ = self._spilled.pop(key)
+        session: Session = pickle.loads(zlib.decompress(compressed))
+        session.gc.members = self._members
+        self._sessions[key] = session
+        if self.on_load is not None:
+            self.on_load(session)
+        return session
+
+    def bind_dm(self, user_id: int, session: Session) -> None:
+        self._dm_routes[user_id] = session.key
+
+    def dispatch(self, session: Session, message: discord.Message) -> OnMessageResponse:
+        """
+        コントローラにメッセージを渡す。状態を変えるコマンドであれば先にジャーナルに記録し、
+        記録した乱数の種を設定してから処理することで、再生したときに同じ結果になるようにする。
+        """
+        if not session.gc.is_journaled(message.content):
+            return session.gc.on_message(message)
+        self._touch(session.key)
+        if self._journal is None:
+            return session.gc.on_message(message)
+        seed = random.SystemRandom().getrandbits(64)
+        self._seqs[session.key] = self._journal.append({
+            "key": session.key,
+            "author_id": message.author.id,
+            "author_name": message.author.name,
+            "content": message.content,
+            "dm": message.guild is None,
+            "seed": seed,
+        })
+        random.seed(seed)
+        return session.gc.on_message(message)
+
+    def switch_game(self, session: Session, switch_id: int) -> None:
+        gc = self._create_controller(switch_id)
+        gc.initialize(self._members, session.key)
+        gc.use_carryover(session.carryover)
+        session.gc = gc
+        session.editable_messages = {}
+
+    def expire(self, session: Session) -> OnMessageResponse:
+        """
+        締め切りを過ぎたセッションを進める。コマンドと同様にジャーナルに記録する。
+        """
+        self._touch(session.key)
+        if self._journal is not None:
+            seed = random.SystemRandom().getrandbits(64)
+            self._seqs[session.key] = self._journal.append({"key": session.key, "deadline": True, "seed": seed})
+            random.seed(seed)
+        return session.gc.on_deadline()
+
+    def _touch(self, key: int) -> None:
+        self._dirty.add(key)
+        self._resized.add(key)
+
+    async def measure(self) -> Dict[int, int]:
+        """
+        メモリ上の各セッションを直列化したときの大きさを返す。
+        前回から変更のあったセッションだけをロックを持ったまま別スレッドで直列化し、それ以外は前回の値を使う。
+        """
+        loop = asyncio.get_running_loop()
+        for key in list(self._resized):
+            session = self._sessions.get(key)
+            if session is None:
+                self._resized.discard(key)
+                continue
+            async with session.lock:
+                if self._sessions.get(key) is not session:
+                    continue
+                self._resized.discard(key)
+                blob = await loop.run_in_executor(None, pickle.dumps, session, pickle.HIGHEST_PROTOCOL)
+                self._sizes[key] = len(blob)
+        return {key: self._sizes.get(key, 0) for key in self._sessions.keys()}
+
+    def apply(self, session: Session, on_message_res: OnMessageResponse) -> None:
+        if on_message_res.switch_game:
+            self.switch_game(session, on_message_res.switch_game)
+
+    async def snapshot(self) -> None:
+        """
+        前回から変更のあったセッションだけを直列化し、全セッション分をジャーナルに書かせる。
+        直列化はセッションのロックを持ったまま別スレッドで行い、その間も他のセッションは処理を続ける。
+        """
+        if self._journal is None or len(self._dirty) == 0:
+            return
+        seq = self._journal.get_seq()
+        dirty, self._dirty = self._dirty, set()
+        loop = asyncio.get_running_loop()
+        for key in dirty:
+            session = self._sessions.get(key)
+            if session is None:
+                continue
+            async with session.lock:
+                if self._sessions.get(key) is not session:
+                    # ロックを待っている間に退避または破棄された
+                    continue
+                session_seq = self._seqs.get(key, 0)
+                blob = await loop.run_in_executor(None, pickle.dumps, session, pickle.HIGHEST_PROTOCOL)
+                self._sizes[key] = len(blob)
+                self._resized.discard(key)
+            self._snapshot_blobs[key] = blob
+            self._snapshot_seqs[key] = session_seq
+        self._journal.write_snapshot(Snapshot(
+            seq, dict(self._snapshot_blobs), dict(self._dm_routes), dict(self._snapshot_seqs),
+        ))
+
+    def restore(self) -> int:
+        """
+        最新のスナップショットを読み込み、それ以降のジャーナルを再生する。再生した件数を返す。
+        再生したコマンドの応答は送らないため、外部に書き出すものは呼び出し側で止めておく。
+        """
+        if self._journal is None:
+            return 0
+        snapshot = self._journal.load_snapshot()
+        after_seq = 0
+        if snapshot is not None:
+            after_seq = snapshot.seq
+            for key, blob in snapshot.sessions.items():
+                session: Session = pickle.loads(blob)
+                session.gc.members = self._members
+                self._sessions[key] = session
+                self._snapshot_blobs[key] = blob
+            self._dm_routes.update(snapshot.dm_routes)
+            self._snapshot_seqs.update(snapshot.session_seqs)
+            self._seqs.update(snapshot.session_seqs)
+
+        num_replayed = 0
+        for entry in self._journal.read_entries(after_seq):
+            if entry["seq"] <= self._snapshot_seqs.get(entry["key"], 0):
+                # スナップショットに含まれている
+                continue
+            if entry.get("drop"):
+                self._discard(entry["key"])
+                self._seqs[entry["key"]] = entry["seq"]
+                num_replayed += 1
+                continue
+            session = self.get_or_create(entry["key"])
+            self._seqs[session.key] = entry["seq"]
+            self._touch(session.key)
+            random.seed(entry["seed"])
+            try:
+                if entry.get("deadline"):
+                    on_message_res = session.gc.on_deadline()
+                else:
+                    on_message_res = session.gc.on_message(ReplayMessage(
+                        entry["content"], ReplayAuthor(entry["author_id"], entry["author_name"]),
+                    ))
+            except Exception as e:
+                print(f"failed to replay journal entry {entry['seq']}: {e!r}")
+                continue
+            if on_message_res.message_list and not entry.get("dm", True):
+                self.bind_dm(entry["author_id"], session)
+            self.apply(session, on_message_res)
+            num_replayed += 1
+        return num_replayed
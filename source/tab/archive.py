@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Tuple
+
+class BookArchive:
+    """
+    完成した本を別スレッドで保存する。ゲーム終了時の処理を待たせない。
+    """
+    _root: str
+    _executor: ThreadPoolExecutor
+
+    def __init__(self, root: str) -> None:
+        self._root = root
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="book_archive")
+
+    def __getstate__(self) -> dict:
+        return {"root": self._root}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["root"])
+
+    def submit(self, books: List[Tuple[str, bytes]]) -> Future:
+        """
+        books: ファイル名と本文のバイト列の組のリスト
+        """
+        ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        savedir = os.path.join(self._root, f"{ts}_{uuid.uuid4().hex[:8]}")
+        future = self._executor.submit(self._write, savedir, books)
+        future.add_done_callback(self._report)
+        return future
+
+    @staticmethod
+    def _write(savedir: str, books: List[Tuple[str, bytes]]) -> None:
+        os.makedirs(savedir, exist_ok=True)
+        for filename, data in books:
+            path = os.path.join(savedir, filename.replace(os.sep, "_"))
+            with open(path, "wb") as f:
+                f.write(data)
+
+    @staticmethod
+    def _report(future: Future) -> None:
+        if future.exception() is not None:
+            print(f"failed to archive books: {future.exception()!r}")
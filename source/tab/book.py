@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+from typing import Iterator
 
 class InvalidPageError(Exception):
     pass
@@ -10,10 +11,12 @@ class LineBreakForbiddenError(Exception):
 class Book:
     _title: str or None
     _scripts: list # of string or None
+    _rendered: list # of string or None
 
     def __init__(self) -> None:
         self._title = None
         self._scripts = []
+        self._rendered = []
     
     def set_title(self, title: str) -> None:
         if "\n" in title:
@@ -22,14 +25,17 @@ class Book:
     
     def add_page(self) -> None:
         self._scripts.append(None)
+        self._rendered.append(None)
     
     def set_script(self, script: str, page: int) -> None:
         if page > len(self._scripts):
             raise InvalidPageError()
         elif page == len(self._scripts):
             self._scripts.append(script)
+            self._rendered.append(render_page(script))
         else:
             self._scripts[page] = script
+            self._rendered[page] = render_page(script)
     
     def get_title(self) -> str:
         return self._title
@@ -37,22 +43,29 @@ class Book:
     def get_scripts(self) -> list:
         return self._scripts
     
-    def generate_markdown(self, pln_list: list) -> str:
+    def iter_markdown(self, pln_list: list) -> Iterator[str]:
         """
         pln_list: プレイヤー名のリスト。記述順に入っている（先頭がオーナー）
+        各ページの本文は set_script の時点で変換済みのものを使う。
         """
-        ret_str = ""
-        ret_str += f"# 「{self._title}」\n"
-        ret_str += f"作：{pln_list[0]}\n\n"
+        yield f"# 「{self._title}」\n"
+        yield f"作：{pln_list[0]}\n\n"
 
         for i in range(len(self._scripts)):
-            ret_str += f"## {i + 1} ({pln_list[i % len(pln_list)]})\n\n"
-            lines = self._scripts[i].splitlines()
-            for j in range(len(lines)):
-                if len(lines[j]) == 0:
-                    ret_str += "\n"
-                else:
-                    ret_str += lines[j] + "  \n"
-            ret_str += "\n"
+            yield f"## {i + 1} ({pln_list[i % len(pln_list)]})\n\n"
+            rendered = self._rendered[i]
+            yield "\n" if rendered is None else rendered
+
+    def generate_markdown(self, pln_list: list) -> str:
+        """
+        pln_list: プレイヤー名のリスト。記述順に入っている（先頭がオーナー）
+        """
+        return "".join(self.iter_markdown(pln_list))
 
-        return ret_str
\ No newline at end of file
+def render_page(script: str) -> str:
+    """
+    1ページ分の本文をMarkdownに変換する。空行以外の行末には改行用の空白2つを付ける。
+    """
+    return "".join(
+        "\n" if len(line) == 0 else line + "  \n" for line in script.splitlines()
+    ) + "\n"
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import datetime
-import os
+import io
 import random
+from array import array
+from typing import List, Tuple
 
 from source.tab.book import Book
 
@@ -51,12 +52,22 @@ class Player:
 class PlayerMaster:
     _players: list # of Player
     _rand_indexes: list # of int
-    _name_index_map: dict # of str: int
+    _seat_map: dict # of str: int
+    _schedule: array # of int
+    _authors: array # of int
+    _page: int
+    _num_titles_set: int
+    _num_scripts_set: int
 
     def __init__(self):
         self._players = []
         self._rand_indexes = []
-        self._name_index_map = {}
+        self._seat_map = {}
+        self._schedule = array("i")
+        self._authors = array("i")
+        self._page = 0
+        self._num_titles_set = 0
+        self._num_scripts_set = 0
 
     def add_player(self, player_name: str) -> bool:
         ok = True
@@ -92,58 +103,96 @@ class PlayerMaster:
         return len(self._players)
 
     def setup(self) -> None:
-        self._rand_indexes = list(range(len(self._players)))
+        """
+        プレイヤーiがkページ目に書く本の番号を _schedule[k * n + i] に、
+        本bのkページ目を書くプレイヤーの番号を _authors[k * n + b] に記録する（kはnで割った余り）。
+        """
+        n = len(self._players)
+        self._rand_indexes = list(range(n))
         random.shuffle(self._rand_indexes)
-        for i in range(len(self._players)):
+        pos = [0] * n
+        for i, ri in enumerate(self._rand_indexes):
+            pos[ri] = i
+        self._schedule = array("i", [
+            self._rand_indexes[(pos[i] + k) % n] for k in range(n) for i in range(n)
+        ])
+        self._authors = array("i", [
+            self._rand_indexes[(pos[b] - k) % n] for k in range(n) for b in range(n)
+        ])
+        self._page = 0
+        self._num_titles_set = 0
+        self._num_scripts_set = 0
+        self._seat_map = {}
+        for i in range(n):
             self._players[i].reset_book()
-            p_name = self._players[i].get_name()
-            self._name_index_map[p_name] = i
+            self._seat_map[self._players[i].get_name()] = i
             self._players[i].add_book_page()
+
+    def _target_book_index(self, player_name: str) -> int:
+        seat = self._seat_map.get(player_name)
+        if seat is None:
+            raise UnknownPlayerError()
+        n = len(self._players)
+        return self._schedule[(self._page % n) * n + seat]
     
     def get_target_book_title(self, player_name: str) -> str:
-        target_book_index = self._name_index_map.get(player_name)
-        if target_book_index is None:
-            raise UnknownPlayerError()
-        return self._players[target_book_index].get_book_title()
+        return self._players[self._target_book_index(player_name)].get_book_title()
     
     def set_book_title(self, player_name: str, title: str) -> bool:
-        tgt_i = -1
-        for i in range(len(self._players)):
-            if self._players[i].get_name() == player_name:
-                tgt_i = i
-                break
-        if tgt_i < 0:
+        seat = self._seat_map.get(player_name)
+        if seat is None:
             raise UnknownPlayerError()
-        self._players[tgt_i].set_book_title(title)
+        was_set = self._players[seat].title_is_set()
+        self._players[seat].set_book_title(title)
+        if not was_set:
+            self._num_titles_set += 1
         return self.titles_are_set()
     
     def get_target_last_script(self, player_name: str) -> str:
-        target_book_index = self._name_index_map.get(player_name)
-        if target_book_index is None:
-            raise UnknownPlayerError()
-        return self._players[target_book_index].get_book_scripts()[-2]
+        return self._players[self._target_book_index(player_name)]\
+                                                .get_book_scripts()[-2]
     
     def set_book_script(self, player_name: str, script: str, page: int) \
                                                                 -> bool:
-        target_book_index = self._name_index_map.get(player_name)
-        if target_book_index is None:
-            raise UnknownPlayerError()
-        self._players[target_book_index].set_book_script(script, page)
+        target = self._players[self._target_book_index(player_name)]
+        scripts = target.get_book_scripts()
+        counts = page == self._page and page < len(scripts) and scripts[page] is None
+        target.set_book_script(script, page)
+        if counts:
+            self._num_scripts_set += 1
         return self.latest_scripts_are_set()
     
     def turn_page(self) -> None:
-        for i in range(len(self._players)):
-            p_name = self._players[i].get_name()
-            next_i = find_next(self._rand_indexes,
-                                self._name_index_map[p_name])
-            self._name_index_map[p_name] = self._rand_indexes[next_i]
-            self._players[i].add_book_page()
-    
+        self._page += 1
+        self._num_scripts_set = 0
+        for player in self._players:
+            player.add_book_page()
+
+    def get_author_name(self, book_index: int, page: int) -> str:
+        n = len(self._players)
+        return self._players[self._authors[(page % n) * n + book_index]].get_name()
+
+    def get_pending_title_players(self) -> List[str]:
+        return [p.get_name() for p in self._players if not p.title_is_set()]
+
+    def get_pending_script_players(self) -> List[str]:
+        return [
+            p.get_name() for p in self._players
+            if self._players[self._target_book_index(p.get_name())]
+                                .get_book_scripts()[self._page] is None
+        ]
+
     def titles_are_set(self) -> bool:
-        return all(p.title_is_set() for p in self._players)
+        return self._num_titles_set == len(self._players)
 
     def latest_scripts_are_set(self) -> bool:
-        return all(p.latest_script_is_set() for p in self._players)
+        return self._num_scripts_set == len(self._players)
+
+    def count_titles_set(self) -> int:
+        return self._num_titles_set
+
+    def count_scripts_set(self) -> int:
+        return self._num_scripts_set
 
     def get_book(self, player_name: str) -> list:
         found = False
@@ -155,39 +204,16 @@ class PlayerMaster:
         if not found:
             raise UnknownPlayerError()
     
-    def save_books(self) -> list:
-        ts = datetime.datetime.now().strftime("%Y%m%d_%H%M")
-        savedir = os.path.join("storage", ts)
-        os.makedirs(savedir, exist_ok=True)
-        path_list = []
+    def export_books(self) -> List[Tuple[str, io.BytesIO]]:
+        """
+        全員の本をMarkdownとしてメモリ上に書き出し、ファイル名とバッファの組のリストを返す。
+        """
+        ret = []
         for i, p in enumerate(self._players):
-            ind_list = cycle_until(self._rand_indexes[::-1], i)
-            pln_list = [self._players[i].get_name() for i in ind_list]
+            pln_list = [
+                self.get_author_name(i, k) for k in range(len(self._players))
+            ]
             book = p.get_book()
-            book_md = book.generate_markdown(pln_list)
-            book_md_path = os.path.join(savedir,
-                                        f"{i + 1}_{book.get_title()}.md")
-            with open(book_md_path, "w") as f:
-                f.write(book_md)
-            path_list.append(book_md_path)
-        return path_list
-
-def find_next(l: list, v: any) -> int:
-    key_i = -1
-    for i in range(len(l)):
-        if l[i] == v:
-            key_i = i
-            break
-    if key_i < 0:
-        raise ValueError()
-    return (key_i + 1) % len(l)
-
-def cycle_until(l: list, v: any) -> list:
-    key_i = -1
-    for i in range(len(l)):
-        if l[i] == v:
-            key_i = i
-            break
-    if key_i < 0:
-        raise ValueError()
-    return l[key_i:] + l[:key_i]
+            buf = io.BytesIO(book.generate_markdown(pln_list).encode("utf-8"))
+            ret.append((f"{i + 1}_{book.get_title()}.md", buf))
+        return ret
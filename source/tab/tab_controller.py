@@ -1,16 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os
+from types import MappingProxyType
+from typing import Hashable, List, Mapping, Union
 
 import discord
 
 from source.command import Command
-from source.game_controller import GameController, OnMessageResponse, COMMANDS_B, ALWAYS_ALLOWED_COMMANDS_B
+from source.game_controller import GameController, OnMessageResponse, COMMANDS_B, ALWAYS_ALLOWED_COMMANDS_B, HANDLERS_B
+from source.member_directory import MemberDirectory
+from source.router import CommandRouter
+from source.tab.archive import BookArchive
 from source.tab.book import LineBreakForbiddenError
 from source.tab.player import PlayerMaster, UnknownPlayerError
 
 MAX_CYCLES = 10
+DEFAULT_TITLE = "（無題）"
+DEFAULT_SCRIPT = "（白紙）"
 ICONS_T = {
     "MAIN": ":book:",
     "CAUT": ":exclamation:",
@@ -59,53 +65,53 @@ ALWAYS_ALLOWED_COMMANDS_T = [
     "SHOWPL",
 ]
 ALWAYS_ALLOWED_COMMANDS_T += ALWAYS_ALLOWED_COMMANDS_B
+HANDLERS_T = {
+    **HANDLERS_B,
+    "SHOWPL": "show_players",
+    "JOIN": "join",
+    "LEAVE": "leave",
+    "RESETMMB": "reset_players",
+    "SETCYCLES": "set_cycles",
+    "START": "start_game",
+    "QUITGM": "quit_game",
+    "SETTITLE": "set_title",
+    "STARTSCRPT": "start_script",
+    "SETSCRPT": "set_script",
+    "NEXT": "next_turn",
+}
 
 class TABController(GameController):
-    allowed_commands_per_phase: dict # of str: str
-    commands_dictionary: dict # of str: Command
-    function_dictionary: dict # of str: function
+    commands_dictionary: Mapping[str, Command] = MappingProxyType({**COMMANDS_T, **COMMANDS_B})
+    router: CommandRouter = CommandRouter(
+        commands_dictionary, HANDLERS_T,
+        ALLOWED_COMMANDS_PER_PHASE, ALWAYS_ALLOWED_COMMANDS_T,
+    )
     gamech_id: int
     phase: str
     cycles: int
-    members: list # of discord.Member
+    members: MemberDirectory
     playermaster: PlayerMaster
     script_page: int
 
+    archive: Union[BookArchive, None]
+
     title_all_set_notified: bool
     script_all_set_notified: bool
 
-    def initialize(self, get_all_members, gamech_id: int):
-        self.get_all_members = get_all_members
-        self.gamech_id = gamech_id
-        self.members = [member for member in self.get_all_members()]
-        self.playermaster = PlayerMaster()
-
-        self.commands_dictionary = COMMANDS_T
-        self.commands_dictionary.update(COMMANDS_B)
+    def __init__(self, archive: Union[BookArchive, None] = None) -> None:
+        super().__init__()
+        self.archive = archive
 
-        self.allowed_commands_per_phase = {}
-        for p in PHASES.values():
-            self.allowed_commands_per_phase[p] = []
-            for c in ALLOWED_COMMANDS_PER_PHASE[p] + ALWAYS_ALLOWED_COMMANDS_T:
-                self.allowed_commands_per_phase[p]\
-                                .append(self.commands_dictionary[c].get_command())
+    def __getstate__(self) -> dict:
+        # 保存先はボットの設定なので、復元したあとに付け直す
+        state = super().__getstate__()
+        state["archive"] = None
+        return state
 
-        self.function_dictionary = {
-            self.commands_dictionary["HLP"].get_command(): self.help,
-            self.commands_dictionary["SHOWPL"].get_command(): self.show_players,
-            self.commands_dictionary["JOIN"].get_command(): self.join,
-            self.commands_dictionary["LEAVE"].get_command(): self.leave,
-            self.commands_dictionary["RESETMMB"].get_command(): self.reset_players,
-            self.commands_dictionary["SETCYCLES"].get_command(): self.set_cycles,
-            self.commands_dictionary["SETCH"].get_command(): self.set_channel,
-            self.commands_dictionary["RELOADMMB"].get_command(): self.reload_member,
-            self.commands_dictionary["START"].get_command(): self.start_game,
-            self.commands_dictionary["QUITGM"].get_command(): self.quit_game,
-            self.commands_dictionary["SETTITLE"].get_command(): self.set_title,
-            self.commands_dictionary["STARTSCRPT"].get_command(): self.start_script,
-            self.commands_dictionary["SETSCRPT"].get_command(): self.set_script,
-            self.commands_dictionary["NEXT"].get_command(): self.next_turn,
-        }
+    def initialize(self, members: MemberDirectory, gamech_id: int):
+        self.gamech_id = gamech_id
+        self.members = members
+        self.playermaster = PlayerMaster()
 
         self.phase = PHASES["S"]
         self.cycles = 1
@@ -201,6 +207,8 @@ class TABController(GameController):
         all_set = False
         try:
             all_set = self.playermaster.set_book_title(author.name, content)
+            ret_mes += f"（{self.playermaster.count_titles_set()}/" \
+                     + f"{self.playermaster.len_players()}人が設定済み）"
         except LineBreakForbiddenError:
             ret_mes = f"{ICONS_T['CAUT']} 改行を入れないでください！"
         except UnknownPlayerError:
@@ -247,6 +255,8 @@ class TABController(GameController):
         try:
             all_set = self.playermaster.set_book_script\
                                     (author.name, content, self.script_page)
+            ret_mes += f"（{self.playermaster.count_scripts_set()}/" \
+                     + f"{self.playermaster.len_players()}人が設定済み）"
         except UnknownPlayerError:
             ret_mes = f"{ICONS_T['CAUT']} ゲームに参加していません！"
         ret.append((author.name, ret_mes))
@@ -266,14 +276,15 @@ class TABController(GameController):
             # 最終ページが終了した場合
             ret = []
 
-            # 保存
-            paths = self.playermaster.save_books()
+            # 書き出し
+            books = self.playermaster.export_books()
+            if self.archive is not None:
+                self.archive.submit([(name, buf.getvalue()) for name, buf in books])
 
-            # 全員へ完成した本文を送付しファイルを削除する
+            # 全員へ完成した本文を送付する
             players = self.playermaster.get_players()
             for i, p in enumerate(players):
-                ret.append((p.get_name(), discord.File(paths[i])))
-                os.remove(paths[i])
+                ret.append((p.get_name(), discord.File(books[i][1], filename=books[i][0])))
 
             # 共有情報
             ret_mes = f"{ICONS_T['MAIN']} 全員の本が完成しました！参加者全員の個人チャットに完成した本を送付しました。"
@@ -304,3 +315,34 @@ class TABController(GameController):
                 ret.append((p.get_name(), ret_mes))
             
             return OnMessageResponse(ret)
+
+    def get_turn_key(self) -> Union[Hashable, None]:
+        if self.phase == PHASES["GT"]:
+            return (self.phase,)
+        if self.phase == PHASES["GS"]:
+            return (self.phase, self.script_page)
+        return None
+
+    def pending_players(self) -> List[str]:
+        if self.phase == PHASES["GT"]:
+            return self.playermaster.get_pending_title_players()
+        if self.phase == PHASES["GS"]:
+            return self.playermaster.get_pending_script_players()
+        return []
+
+    def on_deadline(self) -> OnMessageResponse:
+        pending = self.pending_players()
+        if self.phase == PHASES["GT"]:
+            for name in pending:
+                self.playermaster.set_book_title(name, DEFAULT_TITLE)
+            ret_mes = f"{ICONS_T['CAUT']} 締め切りを過ぎたため、未設定のタイトルを「{DEFAULT_TITLE}」として進めます。"
+            res = self.start_script(None, None)
+        elif self.phase == PHASES["GS"]:
+            for name in pending:
+                self.playermaster.set_book_script(name, DEFAULT_SCRIPT, self.script_page)
+            ret_mes = f"{ICONS_T['CAUT']} 締め切りを過ぎたため、未設定の本文を「{DEFAULT_SCRIPT}」として進めます。"
+            res = self.next_turn(None, None)
+        else:
+            return OnMessageResponse([])
+        res.message_list.insert(0, (None, ret_mes))
+        return res
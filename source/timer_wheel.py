@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Any, List, Set, Union
+
+DEFAULT_SLOT_BITS = 6
+DEFAULT_LEVELS = 4
+
+class Timer:
+    __slots__ = ("deadline", "payload", "_bucket")
+
+    def __init__(self, deadline: int, payload: Any) -> None:
+        self.deadline = deadline
+        self.payload = payload
+        self._bucket = None
+
+    def is_active(self) -> bool:
+        return self._bucket is not None
+
+class TimerWheel:
+    """
+    階層型タイマーホイール。時刻は整数のティックで扱う。
+    登録と取り消しは定数時間で、advance は進めたティック数と発火したタイマーの数に比例する。
+    下位の輪が一周するたびに上位の輪の1枠分を下位の輪に振り分け直す。
+    """
+    _now: int
+    _bits: int
+    _mask: int
+    _levels: int
+    _wheels: List[List[Set[Timer]]]
+    _len: int
+
+    def __init__(self, now: int, slot_bits: int = DEFAULT_SLOT_BITS, levels: int = DEFAULT_LEVELS) -> None:
+        self._now = now
+        self._bits = slot_bits
+        self._mask = (1 << slot_bits) - 1
+        self._levels = levels
+        self._wheels = [[set() for _ in range(1 << slot_bits)] for _ in range(levels)]
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def get_now(self) -> int:
+        return self._now
+
+    def schedule(self, deadline: int, payload: Any) -> Timer:
+        """
+        deadline: 発火させるティック。過去のティックであれば次の advance で発火する。
+        """
+        timer = Timer(max(deadline, self._now + 1), payload)
+        self._insert(timer)
+        self._len += 1
+        return timer
+
+    def cancel(self, timer: Union[Timer, None]) -> None:
+        if timer is None or timer._bucket is None:
+            return
+        timer._bucket.discard(timer)
+        timer._bucket = None
+        self._len -= 1
+
+    def advance(self, now: int) -> List[Timer]:
+        """
+        now のティックまで進め、その間に期限を迎えたタイマーを返す。
+        """
+        expired: List[Timer] = []
+        while self._now < now:
+            self._now += 1
+            for level in range(1, self._levels):
+                if self._now & ((1 << (self._bits * level)) - 1) != 0:
+                    break
+                slot = (self._now >> (self._bits * level)) & self._mask
+                bucket = self._wheels[level][slot]
+                self._wheels[level][slot] = set()
+                for timer in bucket:
+                    self._insert(timer)
+            slot = self._now & self._mask
+            bucket = self._wheels[0][slot]
+            if bucket:
+                self._wheels[0][slot] = set()
+                for timer in bucket:
+                    timer._bucket = None
+                self._len -= len(bucket)
+                expired.extend(bucket)
+        return expired
+
+    def _insert(self, timer: Timer) -> None:
+        delta = timer.deadline - self._now
+        for level in range(self._levels):
+            if delta < (1 << (self._bits * (level + 1))):
+                slot = (timer.deadline >> (self._bits * level)) & self._mask
+                break
+        else:
+            # 最上位の輪にも収まらない場合は一周後に振り分け直す
+            level = self._levels - 1
+            slot = ((self._now >> (self._bits * level)) - 1) & self._mask
+        bucket = self._wheels[level][slot]
+        bucket.add(timer)
+        timer._bucket = bucket
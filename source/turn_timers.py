@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+from typing import Hashable, List, Tuple
+
+from source.session import Session
+from source.timer_wheel import TimerWheel
+
+TICK_SECONDS = 1.0
+NUDGE = "nudge"
+DEADLINE = "deadline"
+
+class TurnTimers:
+    """
+    全セッションのターンの締め切りと催促を1つのタイマーホイールで管理する。
+    コントローラの get_turn_key が変わるたびに締め切りを設定し直す。
+    締め切りの時刻は Session に持たせ、スナップショットから復元したときに登録し直す。
+    """
+    _wheel: TimerWheel
+    _turn_deadline: float
+    _nudge: float
+
+    def __init__(self, turn_deadline: float, nudge: float, now: float) -> None:
+        """
+        turn_deadline: 各段階の締め切りまでの秒数
+        nudge: 締め切りの何秒前に未提出のプレイヤーへ催促するか（0 で催促しない）
+        """
+        self._wheel = TimerWheel(to_tick(now))
+        self._turn_deadline = turn_deadline
+        self._nudge = nudge
+
+    def __len__(self) -> int:
+        return len(self._wheel)
+
+    def update(self, session: Session, now: float) -> None:
+        """
+        セッションが次の段階に進んでいれば、前の締め切りを取り消して新しく設定する。
+        """
+        turn_key = session.gc.get_turn_key()
+        if turn_key == session.turn_key:
+            return
+        self.cancel(session)
+        session.turn_key = turn_key
+        session.deadline = None if turn_key is None else now + self._turn_deadline
+        self._schedule(session, now)
+
+    def resume(self, session: Session, now: float) -> None:
+        """
+        スナップショットから復元したセッションの締め切りを登録し直す。
+        """
+        if session.turn_key != session.gc.get_turn_key() or session.deadline is None:
+            session.turn_key = None
+            session.deadline = None
+            self.update(session, now)
+        else:
+            self._schedule(session, now)
+
+    def cancel(self, session: Session) -> None:
+        for timer in session.timers:
+            self._wheel.cancel(timer)
+        session.timers = []
+
+    def advance(self, now: float) -> List[Tuple[Session, str, Hashable]]:
+        """
+        now までに期限を迎えたセッション、その種類（NUDGE か DEADLINE）、
+        登録したときの段階の組を返す。
+        """
+        ret = []
+        for timer in self._wheel.advance(to_tick(now)):
+            session, kind, turn_key = timer.payload
+            if is_current(session, turn_key):
+                ret.append(timer.payload)
+        return ret
+
+    def _schedule(self, session: Session, now: float) -> None:
+        if session.deadline is None:
+            return
+        payload = (session, DEADLINE, session.turn_key)
+        session.timers.append(self._wheel.schedule(to_tick(session.deadline), payload))
+        if self._nudge > 0 and session.deadline - self._nudge > now:
+            payload = (session, NUDGE, session.turn_key)
+            session.timers.append(self._wheel.schedule(to_tick(session.deadline - self._nudge), payload))
+
+def is_current(session: Session, turn_key: Hashable) -> bool:
+    """
+    タイマーを登録したときからセッションが先に進んでおらず、退避もされていないかどうか。
+    """
+    return session.turn_key == turn_key and len(session.timers) > 0
+
+def to_tick(t: float) -> int:
+    return math.ceil(t / TICK_SECONDS)
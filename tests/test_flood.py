@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+
+import pytest
+
+from simulate import GAMES, flood
+
+def flood_args(tables: int) -> argparse.Namespace:
+    return argparse.Namespace(
+        players=4, cycles=1, pattern="5,7,5", text_length=20, tables=tables, send_latency=1.0,
+    )
+
+@pytest.mark.parametrize("name", list(GAMES.keys()))
+def test_flood_one_table(name: str) -> None:
+    r = flood(name, flood_args(1))
+    assert r["max_in_flight_per_session"] == 1
+
+@pytest.mark.parametrize("name", list(GAMES.keys()))
+def test_flood_many_tables(name: str) -> None:
+    r = flood(name, flood_args(8))
+    assert r["max_in_flight_per_session"] == 1
+    assert r["max_in_flight"] > 1